@@ -0,0 +1,263 @@
+"""
+Micro-benchmarks for graph building, crime counting and the route search.
+
+Synthetic pubs and crimes are generated from a fixed seed over the same area at
+increasing densities, so runs are comparable between commits. Every stage is
+timed (best of --repeat runs) and profiled with tracemalloc (one extra run), and
+each optimised path is checked against a reference implementation of the
+original code. Nothing here touches the network.
+
+    python bench.py [--sizes 10:1000,30:5000] [--repeat 3] [--output out.json] [--compare base.json]
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from geopy.distance import geodesic
+from get_pubs import PubData, adjust_pub_ratings_for_crime
+from get_routes import (create_graph_from_routes, add_shortest_edges_to_connect_graph, fetch_pub_routes,
+                        select_best_and_worst_routes, get_nearest_pubs)
+from edge_costs import StraightLineCostProvider
+from graph import CompactGraph
+from neighbours import candidate_pairs
+import search
+
+# (pubs, crimes) per benchmark size, all over the same area.
+SIZES = [(10, 1000), (30, 5000), (100, 20000), (300, 50000)]
+AREA_CENTRE = (51.4315, -0.548)
+AREA_HALF_SIZE_DEG = (0.015, 0.024)  # roughly 3.3km x 3.3km
+SEED = 2024
+CRIME_RADIUS_KM = 0.3
+# Edge weights the searches are checked at: the "walking": 1 preference and the default
+# "walking": 2, whose fractional weight exposes any difference in float rounding.
+EDGE_WEIGHTS = [2, 0.3]
+
+# The reference implementations are slow, so they are only run up to these sizes.
+LEGACY_SEARCH_MAX_PUBS = 100
+REFERENCE_CRIME_MAX_PAIRS = 500_000  # pubs x crimes
+REFERENCE_PAIRS_MAX_PUBS = 100
+
+
+def generate_pubs(n: int, seed: int = SEED) -> list[PubData]:
+    """n pubs spread uniformly over the benchmark area, with Google-style 1-5 star ratings."""
+    rng = random.Random(seed)
+    (lat, lng), (d_lat, d_lng) = AREA_CENTRE, AREA_HALF_SIZE_DEG
+    return [
+        PubData(
+            name=f"Pub {i}",
+            latitude=lat + rng.uniform(-d_lat, d_lat),
+            longitude=lng + rng.uniform(-d_lng, d_lng),
+            place_id=f"bench-{i}",
+            rating=round(rng.uniform(1, 5), 1),
+            user_ratings_total=rng.randint(1, 1000)
+        )
+        for i in range(n)
+    ]
+
+
+def generate_crimes(n: int, seed: int = SEED) -> list[dict]:
+    """n crimes in the police API's format, clustered around a few hotspots like real data."""
+    rng = random.Random(seed + 1)
+    (lat, lng), (d_lat, d_lng) = AREA_CENTRE, AREA_HALF_SIZE_DEG
+    hotspots = [(lat + rng.uniform(-d_lat, d_lat), lng + rng.uniform(-d_lng, d_lng)) for _ in range(8)]
+    crimes = []
+    for i in range(n):
+        if rng.random() < 0.5:
+            hot_lat, hot_lng = rng.choice(hotspots)
+            point = (rng.gauss(hot_lat, d_lat / 10), rng.gauss(hot_lng, d_lng / 10))
+        else:
+            point = (lat + rng.uniform(-d_lat, d_lat), lng + rng.uniform(-d_lng, d_lng))
+        crimes.append({
+            "id": i,
+            "category": "anti-social-behaviour",
+            "location": {"latitude": f"{point[0]:.6f}", "longitude": f"{point[1]:.6f}"}
+        })
+    return crimes
+
+
+def reference_crime_counts(pubs: list[PubData], crimes: list, threshold_km: float) -> list[int]:
+    """The original count: a geodesic distance from every pub to every crime."""
+    return [
+        sum(1 for crime in crimes
+            if geodesic((pub.latitude, pub.longitude),
+                        (float(crime["location"]["latitude"]), float(crime["location"]["longitude"]))).km
+            <= threshold_km)
+        for pub in pubs
+    ]
+
+
+def reference_pairs(pubs: list[PubData], k: int = 3) -> set:
+    """The original neighbour pairs: each pub with its k nearest by geodesic distance."""
+    return {frozenset((pub.place_id, other.place_id)) for pub in pubs for other in get_nearest_pubs(pub, pubs, k)}
+
+
+def vertex_weight(vertex) -> float:
+    return vertex.attr["rating"]
+
+
+def search_stage(method: str, edge_weight: float) -> str:
+    """Stage name of a route search; the first edge weight keeps the plain name."""
+    return f"search_{method}" if edge_weight == EDGE_WEIGHTS[0] else f"search_{method}_w{edge_weight}"
+
+
+def measure(func, repeat: int) -> tuple[float, float, object]:
+    """
+    Run func 'repeat' times and once more under tracemalloc.
+    Returns (best seconds, peak KiB, result of the last run).
+    """
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak / 1024, result
+
+
+def bench_size(n_pubs: int, n_crimes: int, repeat: int) -> list[dict]:
+    """Benchmark every stage at one size, returning one record per stage."""
+    pubs = generate_pubs(n_pubs)
+    crimes = generate_crimes(n_crimes)
+    provider = StraightLineCostProvider()
+    results = []
+
+    def record(stage, func, check=None):
+        seconds, peak_kib, result = measure(func, repeat)
+        results.append({
+            "pubs": n_pubs, "crimes": n_crimes, "stage": stage,
+            "seconds": round(seconds, 6), "peak_kib": round(peak_kib, 1),
+            "matches_reference": check(result) if check else None
+        })
+        return result
+
+    check_pairs = None
+    if n_pubs <= REFERENCE_PAIRS_MAX_PUBS:
+        expected_pairs = reference_pairs(pubs)
+        check_pairs = lambda pairs: {frozenset((a.place_id, b.place_id)) for a, b in pairs} == expected_pairs
+    record("candidate_pairs", lambda: candidate_pairs(pubs), check_pairs)
+
+    routes = record("edge_costs", lambda: fetch_pub_routes(pubs, provider))
+    graph, pub_map = record("create_graph_from_routes", lambda: create_graph_from_routes(routes, pubs))
+
+    def connect():
+        # Connecting mutates the graph, so each run gets a fresh copy.
+        fresh_graph, fresh_map = create_graph_from_routes(routes, pubs)
+        return add_shortest_edges_to_connect_graph(fresh_graph, pubs, fresh_map, provider)
+    graph = record("add_shortest_edges_to_connect_graph", connect)
+
+    check_counts = None
+    if n_pubs * n_crimes <= REFERENCE_CRIME_MAX_PAIRS:
+        expected_counts = reference_crime_counts(pubs, crimes, CRIME_RADIUS_KM)
+        check_counts = lambda counted: [pub.crime_count for pub in counted] == expected_counts
+
+    def count_crimes():
+        counted = [PubData(pub.name, pub.latitude, pub.longitude, rating=pub.rating) for pub in pubs]
+        adjust_pub_ratings_for_crime(counted, crimes, threshold_km=CRIME_RADIUS_KM)
+        return counted
+    record("count_crimes", count_crimes, check_counts)
+
+    compact = record("compact_graph", lambda: CompactGraph.from_graph(graph))
+
+    legacy = {}
+    if n_pubs <= LEGACY_SEARCH_MAX_PUBS:
+        for edge_weight in EDGE_WEIGHTS:
+            legacy[edge_weight] = record(
+                search_stage("legacy", edge_weight),
+                lambda: select_best_and_worst_routes(graph, vertex_weight, edge_weight))
+
+    def same_as_legacy(edge_weight, same_routes):
+        # The stream search may pick a different route among equal weights.
+        def check(found):
+            if edge_weight not in legacy:
+                return None
+            expected = legacy[edge_weight]
+            best, best_w, worst, worst_w = found
+            return ((not same_routes or (best == expected[0] and worst == expected[2]))
+                    and math.isclose(best_w, expected[1], abs_tol=1e-9)
+                    and math.isclose(worst_w, expected[3], abs_tol=1e-9))
+        return check
+
+    for edge_weight in EDGE_WEIGHTS:
+        for method in ("exact", "stream"):
+            record(search_stage(method, edge_weight),
+                   lambda: search.best_and_worst_routes(compact, vertex_weight, edge_weight, method),
+                   same_as_legacy(edge_weight, same_routes=method == "exact"))
+
+    def frontier_has_legacy_best(frontiers):
+        # Benchmark pubs have no crimes, so the best crawl maximises rating - edge_weight * minutes.
+        if not legacy:
+            return None
+        for edge_weight, expected in legacy.items():
+            best = max((rating - crime - edge_weight * minutes
+                        for _, rating, crime, minutes in frontiers["peacekeeper"]), default=None)
+            if not (expected[1] is None if best is None else math.isclose(best, expected[1], abs_tol=1e-9)):
+                return False
+        return True
+    record("search_frontier",
+           lambda: search.pareto_routes(compact, vertex_weight, lambda vertex: vertex.attr["nearby_crimes"]),
+           frontier_has_legacy_best)
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(results: list[dict], baseline: list[dict]):
+    """Print each stage's time against a baseline run's."""
+    before = {(r["pubs"], r["crimes"], r["stage"]): r for r in baseline}
+    for r in results:
+        old = before.get((r["pubs"], r["crimes"], r["stage"]))
+        if old and old["seconds"] > 0:
+            print(f"{r['pubs']:>4} pubs {r['crimes']:>6} crimes  {r['stage']:<36} "
+                  f"{old['seconds']:10.4f}s -> {r['seconds']:10.4f}s  x{old['seconds'] / max(r['seconds'], 1e-9):.2f}",
+                  file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", help="comma separated pubs:crimes pairs (default: %(default)s)",
+                        default=",".join(f"{p}:{c}" for p, c in SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="a previous JSON report to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes.split(","):
+        n_pubs, n_crimes = map(int, size.split(":"))
+        print(f"Benchmarking {n_pubs} pubs, {n_crimes} crimes...", file=sys.stderr)
+        results.extend(bench_size(n_pubs, n_crimes, args.repeat))
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "seed": SEED,
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    mismatches = [r for r in results if r["matches_reference"] is False]
+    for r in mismatches:
+        print(f"MISMATCH: {r['stage']} at {r['pubs']} pubs, {r['crimes']} crimes", file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,96 @@
+"""
+Startup-time benchmark for the server entry point.
+
+Runs `python -X importtime -c "import main"` in fresh interpreters and reports the
+median total import time, the slowest direct imports, and whether any of the
+plotting/NLP modules the serving path should never load were imported.
+
+    python bench_startup.py [--module main] [--runs 5] [--top 10] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules that are only needed for plotting or NLP, never to serve a request.
+HEAVY_MODULES = ["matplotlib", "networkx", "folium", "nltk"]
+
+
+def import_times(module: str) -> list[tuple[int, int, int, str]]:
+    """
+    Import 'module' in a fresh interpreter and return its -X importtime records
+    as (self_us, cumulative_us, depth, name), in the order Python reports them.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr}")
+
+    records = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented by two spaces per level.
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        records.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return records
+
+
+def bench(module: str = "main", runs: int = 5, top: int = 10) -> dict:
+    """
+    Import 'module' 'runs' times and summarise the timings (in milliseconds).
+    """
+    totals = []
+    direct = {}
+    loaded = set()
+    for _ in range(runs):
+        records = import_times(module)
+        end = next(i for i, (_, _, depth, name) in enumerate(records) if depth == 0 and name == module)
+        # Records are reported after their own imports, so the module's tree ends at 'end'
+        # and starts after the previous top-level record.
+        start = max((i + 1 for i, record in enumerate(records[:end]) if record[2] == 0), default=0)
+        totals.append(records[end][1] / 1000)
+        for _, cumulative, depth, name in records[start:end]:
+            loaded.add(name.split(".")[0])
+            if depth == 1:
+                direct.setdefault(name, []).append(cumulative / 1000)
+
+    slowest = sorted(((name, statistics.median(times)) for name, times in direct.items()),
+                     key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "module": module,
+        "runs": runs,
+        "median_ms": round(statistics.median(totals), 1),
+        "min_ms": round(min(totals), 1),
+        "max_ms": round(max(totals), 1),
+        "slowest_imports_ms": {name: round(ms, 1) for name, ms in slowest},
+        "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in loaded]
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    summary = bench(args.module, args.runs, args.top)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"import {summary['module']}: median {summary['median_ms']} ms "
+              f"(min {summary['min_ms']}, max {summary['max_ms']}) over {summary['runs']} runs")
+        print("Slowest direct imports:")
+        for name, ms in summary["slowest_imports_ms"].items():
+            print(f"  {ms:8.1f} ms  {name}")
+        if summary["heavy_modules_loaded"]:
+            print(f"Plotting/NLP modules loaded: {', '.join(summary['heavy_modules_loaded'])}")
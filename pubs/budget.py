@@ -0,0 +1,83 @@
+import logging
+import math
+import threading
+from metrics import DEGRADED
+
+# Most calls one crawl request may make to each upstream. Cache hits are free; past
+# these the planner degrades instead of calling out.
+CALL_LIMITS = {
+    "places_search": 45,  # nearby search pages, MAX_PAGES reserved per circle
+    "places_details": 120,
+    "police": 16,
+    "distance_matrix": 20,
+    "directions": 12,
+}
+# A re-plan from an area snapshot (see snapshot.py) never searches for pubs or costs
+# walks again; it may fetch another month's crimes and the new crawl's legs and extras.
+REPLAN_CALL_LIMITS = {**CALL_LIMITS, "places_search": 0, "distance_matrix": 0}
+
+# What each stage falls back to when its upstream's budget runs out, in the order
+# the stages are reported.
+DEGRADATIONS = {
+    "places_search": "circles past the budget are not searched, so distant pubs may be missing",
+    "place_details": "pubs past the budget keep the rating from their search result",
+    "crimes": "crime tiles furthest from the pubs' centre are not fetched",
+    "walking_times": "walking times are straight-line estimates",
+    "polylines": "legs are drawn as straight lines, timed as in the walking-time graph",
+    "pub_extras": "phone numbers and photos are missing",
+}
+
+logger = logging.getLogger(__name__)
+
+
+class CallBudget:
+    """
+    The upstream calls one request may still make.
+
+    Callers take() budget before each call that would go out and, when it is refused,
+    fall back to a cheaper answer and record the stage with degrade(). Every caller
+    takes budget from a single thread in an order fixed by the request (search order,
+    distance from the pubs' centre, batch plan, crawl order) rather than by which
+    response arrives first, so the same request against the same cache degrades the
+    same way every time.
+    """
+
+    def __init__(self, limits: dict = None):
+        self.limits = dict(CALL_LIMITS if limits is None else limits)
+        self.used = {}
+        self._degraded = set()
+        self._lock = threading.Lock()
+
+    def remaining(self, upstream: str) -> float:
+        """Calls left for 'upstream' (infinite if it has no limit)."""
+        limit = self.limits.get(upstream)
+        if limit is None:
+            return math.inf
+        return limit - self.used.get(upstream, 0)
+
+    def take(self, upstream: str, calls: int = 1) -> bool:
+        """Reserve 'calls' calls to 'upstream', or return False if that would exceed its limit."""
+        with self._lock:
+            if self.remaining(upstream) < calls:
+                return False
+            self.used[upstream] = self.used.get(upstream, 0) + calls
+            return True
+
+    def give_back(self, upstream: str, calls: int):
+        """Return reserved calls that turned out not to be needed."""
+        with self._lock:
+            self.used[upstream] = self.used.get(upstream, 0) - calls
+
+    def degrade(self, stage: str):
+        """Record that 'stage' fell back to its cheaper answer for this request."""
+        with self._lock:
+            if stage in self._degraded:
+                return
+            self._degraded.add(stage)
+        DEGRADED.inc(stage=stage)
+        logger.info("Call budget exhausted, degrading %s: %s", stage, DEGRADATIONS.get(stage, ""))
+
+    @property
+    def degraded(self) -> list[str]:
+        """The degraded stages, in DEGRADATIONS order."""
+        return [stage for stage in DEGRADATIONS if stage in self._degraded]
@@ -0,0 +1,251 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from metrics import CACHE_LOOKUPS
+
+# Where the persistent cache lives. Override with PINTCRAWLER_CACHE (":memory:" disables persistence).
+CACHE_PATH = os.environ.get(
+    "PINTCRAWLER_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".pintcrawler_cache.sqlite3")
+)
+
+# Size of a lat/long tile in degrees (~550m north-south, ~350m east-west in the UK).
+TILE_DEGREES = 0.005
+
+
+def tile_key(latitude: float, longitude: float, tile_degrees: float = TILE_DEGREES) -> str:
+    """
+    Quantize a coordinate to the tile containing it, returned as "row:col".
+    Every point inside the same tile maps to the same key.
+    """
+    return f"{math.floor(latitude / tile_degrees)}:{math.floor(longitude / tile_degrees)}"
+
+
+def tile_centre(latitude: float, longitude: float, tile_degrees: float = TILE_DEGREES) -> tuple[float, float]:
+    """
+    Return the centre of the tile containing the given coordinate.
+    """
+    return (
+        (math.floor(latitude / tile_degrees) + 0.5) * tile_degrees,
+        (math.floor(longitude / tile_degrees) + 0.5) * tile_degrees
+    )
+
+
+class PersistentCache:
+    """
+    A small key/value cache backed by SQLite.
+
+    Entries are JSON-encoded and each one carries its own expiry time, so
+    different kinds of data can live in the same file with different TTLs.
+    Caches are separated by namespace, and every instance keeps hit/miss
+    counters for its own lookups.
+    """
+
+    _connections = {}
+    _connections_lock = threading.Lock()
+
+    def __init__(self, namespace: str, default_ttl: float, path: str = CACHE_PATH):
+        self.namespace = namespace
+        self.default_ttl = default_ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = self._connect(path)
+
+    def reopen(self, path: str):
+        """
+        Move this cache to the store at 'path' (e.g. ":memory:"), leaving the entries
+        in its old store where they are.
+        """
+        with self._lock:
+            self.path = path
+            self._conn = self._connect(path)
+
+    @classmethod
+    def _connect(cls, path: str) -> sqlite3.Connection:
+        # One connection per file, shared between namespaces and threads.
+        with cls._connections_lock:
+            if path not in cls._connections:
+                conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache ("
+                    "namespace TEXT NOT NULL, "
+                    "key TEXT NOT NULL, "
+                    "value TEXT NOT NULL, "
+                    "expires_at REAL NOT NULL, "
+                    "PRIMARY KEY (namespace, key))"
+                )
+                cls._connections[path] = conn
+            return cls._connections[path]
+
+    def get(self, key: str):
+        """
+        Return the cached value for 'key', or None if it is missing or expired.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+            if row is None or row[1] < time.time():
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache=self.namespace, result="miss")
+                return None
+            self.hits += 1
+            CACHE_LOOKUPS.inc(cache=self.namespace, result="hit")
+            return json.loads(row[0])
+
+    def __contains__(self, key: str) -> bool:
+        """
+        Whether 'key' has an unexpired entry. Unlike get, this is not counted as a
+        hit or miss.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM cache WHERE namespace = ? AND key = ? AND expires_at >= ?",
+                (self.namespace, key, time.time())
+            ).fetchone()
+            return row is not None
+
+    def set(self, key: str, value, ttl: float = None):
+        """
+        Store 'value' under 'key' for 'ttl' seconds (defaults to the cache's default TTL).
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), time.time() + ttl)
+            )
+
+    def purge_expired(self) -> int:
+        """Delete expired entries in this namespace, returning how many were removed."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND expires_at < ?",
+                (self.namespace, time.time())
+            )
+            return cursor.rowcount
+
+    def clear(self):
+        """Delete every entry in this namespace and reset the counters."""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Return the hit/miss counters for this cache."""
+        total = self.hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+class LRUCache:
+    """
+    A thread-safe in-memory cache holding at most max_entries values, each for
+    'ttl' seconds. When full, the least recently used entry is evicted.
+    Values are stored as-is (not copied), so callers must not mutate them.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, name: str = "memory"):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached value for 'key', or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+            return entry[1]
+
+    def set(self, key, value):
+        """
+        Store 'value' under 'key', evicting the least recently used entry if full.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Delete every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """Return the hit/miss counters for this cache."""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: while one call for a key is running,
+    other callers with that key wait for it and get its result (or its exception)
+    instead of running their own.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        Return func(), or the result of the call already running for 'key'.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
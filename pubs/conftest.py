@@ -0,0 +1,18 @@
+import os
+import sys
+import types
+
+# Keep the tests' caches out of the working tree; set before cache.py is imported.
+os.environ.setdefault("PINTCRAWLER_CACHE", ":memory:")
+
+# A manual script that calls the deployed function, not a test.
+collect_ignore = ["test_api.py"]
+
+# api_key.py holds the Google Maps key and is never committed. The tests never call
+# Google, so any key will do.
+try:
+    import api_key  # noqa: F401
+except ImportError:
+    api_key = types.ModuleType("api_key")
+    api_key.API_KEY = ""
+    sys.modules["api_key"] = api_key
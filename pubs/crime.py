@@ -1,6 +1,20 @@
+import logging
+import math
 import requests
-import folium
-from folium.plugins import MarkerCluster
+from concurrent.futures import ThreadPoolExecutor
+from budget import CallBudget
+from metrics import UPSTREAM_CALLS
+
+CRIMES_URL = "https://data.police.uk/api/crimes-street/{category}"
+
+# Largest tile (km per side) requested in one go; bigger areas are tiled up front.
+CRIME_TILE_KM = 2.0
+# The API refuses custom areas with more than 10,000 crimes (HTTP 503); such tiles are split in four.
+MAX_TILE_SPLITS = 4
+KM_PER_DEGREE_LAT = 111.2
+
+session = requests.Session()
+logger = logging.getLogger(__name__)
 
 def get_crimes_by_point(lat, lng, date="2024-01", category="all-crime"):
     """
@@ -15,21 +29,148 @@ def get_crimes_by_point(lat, lng, date="2024-01", category="all-crime"):
     Returns:
         list: A list of crime records (each as a dictionary), or None if an error occurs.
     """
-    url = f"https://data.police.uk/api/crimes-street/{category}"
+    url = CRIMES_URL.format(category=category)
     params = {
         "date": date,
         "lat": lat,
         "lng": lng
     }
     try:
-        response = requests.get(url, params=params)
+        response = session.get(url, params=params)
         response.raise_for_status()  # Raise an exception for HTTP errors
         crimes = response.json()
         return crimes
     except requests.RequestException as e:
-        print(f"Error fetching crimes by point: {e}")
+        logger.warning("Error fetching crimes by point: %s", e)
         return None
 
+def get_crimes_in_box(south, west, north, east, date="2024-01", category="all-crime", splits=0,
+                      budget: CallBudget = None):
+    """
+    Fetch street-level crimes inside a lat/long box using a custom area (poly) query.
+    If the box holds more crimes than the API will return, it is split into four
+    quarters which are fetched separately, if the budget (when given) has room for them.
+
+    Quarters that cannot be fetched are logged and left out, keeping the crimes of the rest.
+
+    Returns:
+        list: A list of crime records (possibly with duplicates across split boundaries),
+        or None if an error occurs (or no quarter of a split box could be fetched).
+    """
+    poly = f"{south},{west}:{south},{east}:{north},{east}:{north},{west}"
+    try:
+        # POST keeps long poly strings out of the URL.
+        response = session.post(CRIMES_URL.format(category=category), data={"date": date, "poly": poly})
+        if response.status_code == 503 and splits < MAX_TILE_SPLITS:
+            UPSTREAM_CALLS.inc(upstream="police", outcome="split")
+            if budget is not None and not budget.take("police", 4):
+                budget.degrade("crimes")
+                return None
+            mid_lat, mid_lng = (south + north) / 2, (west + east) / 2
+            crimes = []
+            lost = 0
+            quarters = ((south, west, mid_lat, mid_lng), (south, mid_lng, mid_lat, east),
+                        (mid_lat, west, north, mid_lng), (mid_lat, mid_lng, north, east))
+            for quarter in quarters:
+                quarter_crimes = get_crimes_in_box(*quarter, date=date, category=category, splits=splits + 1,
+                                                   budget=budget)
+                if quarter_crimes is None:
+                    lost += 1
+                    continue
+                crimes.extend(quarter_crimes)
+            if lost == len(quarters):
+                return None
+            if lost:
+                logger.warning("Missing the crimes of %d of %d quarters of box %s", lost, len(quarters), poly)
+            return crimes
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        UPSTREAM_CALLS.inc(upstream="police", outcome="ok")
+        return response.json()
+    except requests.RequestException as e:
+        UPSTREAM_CALLS.inc(upstream="police", outcome="error")
+        logger.warning("Error fetching crimes in box: %s", e)
+        return None
+
+def plan_crime_tiles(points, margin_km, tile_km=CRIME_TILE_KM):
+    """
+    Plan the fewest boxes needed to cover every point plus 'margin_km' around it.
+
+    The bounding area is cut into a grid of tiles at most 'tile_km' on a side;
+    tiles that no point's margin reaches are dropped.
+
+    Returns:
+        list: (south, west, north, east) boxes.
+    """
+    if not points:
+        return []
+    mean_lat = sum(lat for lat, _ in points) / len(points)
+    km_per_degree_lng = KM_PER_DEGREE_LAT * math.cos(math.radians(mean_lat))
+    d_lat = margin_km / KM_PER_DEGREE_LAT
+    d_lng = margin_km / km_per_degree_lng
+
+    south = min(lat for lat, _ in points) - d_lat
+    north = max(lat for lat, _ in points) + d_lat
+    west = min(lng for _, lng in points) - d_lng
+    east = max(lng for _, lng in points) + d_lng
+
+    rows = max(1, math.ceil((north - south) * KM_PER_DEGREE_LAT / tile_km))
+    cols = max(1, math.ceil((east - west) * km_per_degree_lng / tile_km))
+    tile_lat = (north - south) / rows
+    tile_lng = (east - west) / cols
+
+    # Mark every tile touched by a point's margin box.
+    needed = set()
+    for lat, lng in points:
+        row_min = max(0, math.floor((lat - d_lat - south) / tile_lat))
+        row_max = min(rows - 1, math.floor((lat + d_lat - south) / tile_lat))
+        col_min = max(0, math.floor((lng - d_lng - west) / tile_lng))
+        col_max = min(cols - 1, math.floor((lng + d_lng - west) / tile_lng))
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                needed.add((row, col))
+
+    return [
+        (south + row * tile_lat, west + col * tile_lng, south + (row + 1) * tile_lat, west + (col + 1) * tile_lng)
+        for row, col in sorted(needed)
+    ]
+
+def get_crimes_for_area(points, margin_km, date="2024-01", category="all-crime", max_workers=4,
+                        budget: CallBudget = None):
+    """
+    Fetch every crime within roughly 'margin_km' of any of the given (lat, lng) points,
+    using a few area queries fetched concurrently instead of one query per point.
+
+    With a budget, tiles are taken nearest the points' centre first and the rest are
+    skipped. Quarters of tiles the API refuses as too busy are paid for when the
+    refusal comes back, from whatever budget is left.
+
+    Returns:
+        list: Unique crime records (deduplicated by 'id').
+    """
+    tiles = plan_crime_tiles(points, margin_km)
+    if budget is not None and tiles:
+        centre_lat = sum(lat for lat, _ in points) / len(points)
+        centre_lng = sum(lng for _, lng in points) / len(points)
+        km_per_degree_lng = KM_PER_DEGREE_LAT * math.cos(math.radians(centre_lat))
+        tiles.sort(key=lambda tile: math.hypot(((tile[0] + tile[2]) / 2 - centre_lat) * KM_PER_DEGREE_LAT,
+                                               ((tile[1] + tile[3]) / 2 - centre_lng) * km_per_degree_lng))
+        affordable = []
+        for tile in tiles:
+            if budget.take("police"):
+                affordable.append(tile)
+            else:
+                budget.degrade("crimes")
+        tiles = affordable
+    unique_crimes = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for crimes in executor.map(
+                lambda tile: get_crimes_in_box(*tile, date=date, category=category, budget=budget), tiles):
+            for crime in crimes or []:
+                crime_id = crime.get("id")
+                if crime_id and crime_id not in unique_crimes:
+                    unique_crimes[crime_id] = crime
+    return list(unique_crimes.values())
+
 def plot_crimes(crimes, lat, lng):
     """
     Plot crimes on an interactive map using Folium.
@@ -39,6 +180,10 @@ def plot_crimes(crimes, lat, lng):
         lat (float): Latitude of the central point.
         lng (float): Longitude of the central point.
     """
+    # Imported here: folium is only needed for plotting and is slow to import.
+    import folium
+    from folium.plugins import MarkerCluster
+
     # Create a map centered on the given coordinates
     crime_map = folium.Map(location=[lat, lng], zoom_start=14, control_scale=True)
 
@@ -0,0 +1,89 @@
+import googlemaps
+import polyline  # used to decode encoded polylines
+from cache import PersistentCache
+from ratelimit import call_with_backoff
+
+# Walking times between two pubs barely change, so directions are cached per unordered pub pair.
+# Distance Matrix results share the cache (see DistanceMatrixCostProvider), so no leg is bought twice.
+DIRECTIONS_TTL = 7 * 24 * 60 * 60  # seconds
+directions_cache = PersistentCache("directions", default_ttl=DIRECTIONS_TTL)
+
+
+def endpoint_id(pub) -> str:
+    """
+    Identify a route endpoint (a PubData or a Location) by its place_id,
+    falling back to its coordinates.
+    """
+    place_id = getattr(pub, "place_id", "") or getattr(pub, "attr", {}).get("place_id", "")
+    return place_id or f"{pub.latitude:.6f},{pub.longitude:.6f}"
+
+
+def pair_key(start_id: str, end_id: str) -> str:
+    """
+    Cache key for an unordered pair of pubs, so A->B and B->A share one entry.
+    """
+    return "|".join(sorted((start_id, end_id)))
+
+
+def is_leg_cached(start, end, with_polyline: bool = False) -> bool:
+    """
+    Whether the directions cache holds the leg between two pubs (and, with
+    'with_polyline', its polyline too, so get_walking_leg would not call out).
+    """
+    leg = directions_cache.get(pair_key(endpoint_id(start), endpoint_id(end)))
+    return leg is not None and (not with_polyline or leg["polyline"] is not None)
+
+
+def get_walking_leg(start, end, gmaps: googlemaps.Client, ttl: float = None, with_polyline: bool = True) -> dict:
+    """
+    Return the walking leg between two pubs as a dict with the distance, duration
+    and encoded overview polyline, using the shared directions cache.
+    The returned dict has "reversed" set when the cached leg was fetched in the
+    opposite direction (its polyline then runs from end to start).
+
+    Legs costed by the Distance Matrix are cached here too, with a polyline of None.
+    Without 'with_polyline' such a leg is returned as it is; otherwise its
+    directions are fetched and replace it.
+    """
+    start_id, end_id = endpoint_id(start), endpoint_id(end)
+    key = pair_key(start_id, end_id)
+    leg = directions_cache.get(key)
+    if leg is None or (with_polyline and leg["polyline"] is None):
+        # No departure_time: it makes every request unique and walking times don't depend on it.
+        directions = call_with_backoff(
+            "directions", gmaps.directions,
+            origin=(start.latitude, start.longitude),
+            destination=(end.latitude, end.longitude),
+            mode="walking"
+        )
+        if not directions:
+            return None
+        route = directions[0]
+        leg_info = route['legs'][0]
+        leg = {
+            "origin": start_id,
+            "distance_m": leg_info['distance']['value'],
+            "distance_text": leg_info['distance']['text'],
+            "duration_s": leg_info['duration']['value'],
+            "duration_text": leg_info['duration']['text'],
+            "polyline": route.get('overview_polyline', {}).get('points', '')
+        }
+        directions_cache.set(key, leg, ttl)
+    return {**leg, "reversed": leg["origin"] != start_id}
+
+
+def get_route_with_polyline(start, end, gmaps: googlemaps.Client):
+    """
+    For a given pair of Location objects, request directions (walking)
+    and extract the distance (meters), duration (minutes) and decode the
+    overview polyline into a list of (latitude, longitude) points.
+    """
+    leg = get_walking_leg(start, end, gmaps)
+    if not leg:
+        return None
+    distance = leg["distance_m"]  # distance in meters
+    duration_minutes = leg["duration_s"] // 60
+    points = polyline.decode(leg["polyline"]) if leg["polyline"] else []
+    if leg["reversed"]:
+        points.reverse()
+    return distance, duration_minutes, points
@@ -0,0 +1,206 @@
+import googlemaps
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from geopy.distance import geodesic
+from budget import CallBudget
+from directions import directions_cache, endpoint_id, pair_key, get_walking_leg, is_leg_cached
+from ratelimit import call_with_backoff
+
+# Distance Matrix limits per request (standard plan).
+MATRIX_MAX_ORIGINS = 25
+MATRIX_MAX_DESTINATIONS = 25
+MATRIX_MAX_ELEMENTS = 100
+
+# Used by the straight-line estimate: typical walking pace and how much longer streets are than a straight line.
+WALKING_SPEED_KMH = 5.0
+DETOUR_FACTOR = 1.3
+
+def seconds_to_minutes(seconds: float) -> int:
+    return round(seconds / 60)
+
+
+class EdgeCostProvider(ABC):
+    """
+    Supplies walking costs for candidate pub pairs when building the route graph.
+
+    Pubs can be PubData or Location objects. get_routes returns one
+    (start_name, end_name, distance_m, minutes) tuple per pair it could cost;
+    pairs with no walking route are left out. Polylines are not fetched here,
+    only for the legs of the chosen crawl.
+
+    Providers that call an API take an optional CallBudget; pairs it cannot pay
+    for get a StraightLineCostProvider estimate instead.
+    """
+
+    @abstractmethod
+    def get_routes(self, pairs: list[tuple]) -> list[tuple]:
+        """Cost each (start, end) pair; see the class docstring for the result."""
+
+
+class DirectionsCostProvider(EdgeCostProvider):
+    """
+    One (cached) Directions request per pair, issued from a thread pool.
+    """
+
+    def __init__(self, gmaps: googlemaps.Client, max_workers: int = 5, budget: CallBudget = None):
+        self.gmaps = gmaps
+        self.max_workers = max_workers
+        self.budget = budget
+
+    def _get_route(self, start, end) -> tuple:
+        leg = get_walking_leg(start, end, self.gmaps, with_polyline=False)
+        if not leg:
+            return None
+        return (start.name, end.name, leg["distance_m"], seconds_to_minutes(leg["duration_s"]))
+
+    def get_routes(self, pairs: list[tuple]) -> list[tuple]:
+        affordable = [self.budget is None
+                      or is_leg_cached(start, end)
+                      or self.budget.take("directions")
+                      for start, end in pairs]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda pair: self._get_route(*pair),
+                                        [pair for pair, ok in zip(pairs, affordable) if ok]))
+        if not all(affordable):
+            self.budget.degrade("walking_times")
+            estimates = iter(StraightLineCostProvider().get_routes(
+                [pair for pair, ok in zip(pairs, affordable) if not ok]))
+            fetched = iter(results)
+            results = [next(fetched) if ok else next(estimates) for ok in affordable]
+        return [result for result in results if result]
+
+
+class DistanceMatrixCostProvider(EdgeCostProvider):
+    """
+    Costs every pair with a handful of many-to-many Distance Matrix requests.
+
+    Pairs are grouped by origin and packed into batches that respect the
+    per-request origin, destination and element limits; batches are sent
+    concurrently. Results go into the directions cache, per unordered pair and
+    without a polyline, so a leg costed here is never costed again by
+    DirectionsCostProvider and get_walking_leg only adds its polyline. With a
+    budget, batches are paid for in plan order and the pairs of any past it are
+    estimated.
+    """
+
+    def __init__(self, gmaps: googlemaps.Client, max_workers: int = 5,
+                 max_origins: int = MATRIX_MAX_ORIGINS,
+                 max_destinations: int = MATRIX_MAX_DESTINATIONS,
+                 max_elements: int = MATRIX_MAX_ELEMENTS,
+                 budget: CallBudget = None):
+        self.gmaps = gmaps
+        self.budget = budget
+        self.max_workers = max_workers
+        self.max_origins = max_origins
+        self.max_destinations = max_destinations
+        self.max_elements = max_elements
+
+    def plan_batches(self, pairs: list[tuple]) -> list[tuple[list, list]]:
+        """
+        Pack the pairs into (origins, destinations) batches within the matrix limits.
+        Origins are visited south to north so neighbouring origins, which tend to share
+        destinations, land in the same batch.
+        """
+        origins_by_id = {}
+        destinations_by_origin = {}
+        for start, end in pairs:
+            origins_by_id[endpoint_id(start)] = start
+            destinations_by_origin.setdefault(endpoint_id(start), {})[endpoint_id(end)] = end
+
+        batches = []
+        origins, destinations = [], {}
+        for origin_id in sorted(origins_by_id, key=lambda i: (origins_by_id[i].latitude, origins_by_id[i].longitude)):
+            merged = {**destinations, **destinations_by_origin[origin_id]}
+            if origins and (len(origins) + 1 > self.max_origins
+                            or len(merged) > self.max_destinations
+                            or (len(origins) + 1) * len(merged) > self.max_elements):
+                batches.append((origins, list(destinations.values())))
+                origins, merged = [], dict(destinations_by_origin[origin_id])
+            origins.append(origins_by_id[origin_id])
+            destinations = merged
+        if origins:
+            batches.append((origins, list(destinations.values())))
+        return batches
+
+    def _fetch_batch(self, batch: tuple[list, list]) -> dict:
+        origins, destinations = batch
+        response = call_with_backoff(
+            "distance_matrix", self.gmaps.distance_matrix,
+            origins=[(pub.latitude, pub.longitude) for pub in origins],
+            destinations=[(pub.latitude, pub.longitude) for pub in destinations],
+            mode="walking"
+        )
+        legs = {}
+        for origin, row in zip(origins, response.get("rows", [])):
+            for destination, element in zip(destinations, row.get("elements", [])):
+                if element.get("status") != "OK":
+                    continue
+                key = pair_key(endpoint_id(origin), endpoint_id(destination))
+                legs[key] = {
+                    "origin": endpoint_id(origin),
+                    "distance_m": element["distance"]["value"],
+                    "distance_text": element["distance"]["text"],
+                    "duration_s": element["duration"]["value"],
+                    "duration_text": element["duration"]["text"],
+                    "polyline": None  # fetched by get_walking_leg if the leg is on a crawl
+                }
+                directions_cache.set(key, legs[key])
+        return legs
+
+    def get_routes(self, pairs: list[tuple]) -> list[tuple]:
+        legs = {}
+        missing = []
+        for start, end in pairs:
+            key = pair_key(endpoint_id(start), endpoint_id(end))
+            if key in legs:
+                continue
+            leg = directions_cache.get(key)
+            if leg is None:
+                missing.append((start, end))
+            else:
+                legs[key] = leg
+
+        estimated = set()
+        if missing:
+            batches = []
+            for batch in self.plan_batches(missing):
+                if self.budget is None or self.budget.take("distance_matrix"):
+                    batches.append(batch)
+                else:
+                    estimated.update(endpoint_id(pub) for pub in batch[0])
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for batch_legs in executor.map(self._fetch_batch, batches):
+                    legs.update(batch_legs)
+            if estimated:
+                self.budget.degrade("walking_times")
+
+        routes = []
+        estimator = StraightLineCostProvider()
+        for start, end in pairs:
+            leg = legs.get(pair_key(endpoint_id(start), endpoint_id(end)))
+            if leg:
+                routes.append((start.name, end.name, leg["distance_m"], seconds_to_minutes(leg["duration_s"])))
+            elif endpoint_id(start) in estimated:
+                routes.extend(estimator.get_routes([(start, end)]))
+        return routes
+
+
+class StraightLineCostProvider(EdgeCostProvider):
+    """
+    Local estimate with no network calls: straight-line distance stretched by
+    DETOUR_FACTOR and walked at WALKING_SPEED_KMH. Used in benchmarks and when a
+    CallBudget runs out.
+    """
+
+    def __init__(self, speed_kmh: float = WALKING_SPEED_KMH, detour_factor: float = DETOUR_FACTOR):
+        self.speed_kmh = speed_kmh
+        self.detour_factor = detour_factor
+
+    def get_routes(self, pairs: list[tuple]) -> list[tuple]:
+        routes = []
+        for start, end in pairs:
+            distance_km = geodesic((start.latitude, start.longitude), (end.latitude, end.longitude)).km
+            distance_km *= self.detour_factor
+            routes.append((start.name, end.name, round(distance_km * 1000),
+                           round(distance_km / self.speed_kmh * 60)))
+        return routes
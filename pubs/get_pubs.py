@@ -1,13 +1,38 @@
 import googlemaps
+import logging
 from geopy.distance import geodesic
 from dataclasses import dataclass
 from api_key import API_KEY
-from crime import get_crimes_by_point
+from budget import CallBudget
+from crime import get_crimes_for_area
+from cache import PersistentCache
+from places import search_places
+from spatial import GridIndex
+from ratelimit import call_with_backoff, new_client
+from concurrent.futures import ThreadPoolExecutor
+from metrics import span
 
 RATING_OFFSET = 25
 RATING_WEIGHT = 10
 CRIME_PENALTY = 2  # Penalty points per nearby crime
 
+PLACES_DETAILS_TTL = 24 * 60 * 60  # seconds
+DETAILS_WORKERS = 8  # Place Details requests in flight at once
+# Place Details are loaded in two tiers: the fields the scoring and route search use,
+# and the contact/atmosphere/review/photo fields only shown for pubs on the chosen crawl.
+SCORING_FIELDS = ["rating", "user_ratings_total"]
+EXTRA_FIELDS = ["formatted_address", "formatted_phone_number", "international_phone_number", "opening_hours",
+                "website", "photo", "serves_beer",
+                "serves_breakfast", "serves_brunch", "serves_dinner", "serves_lunch", "serves_vegetarian_food",
+                "reviews"]
+DETAIL_FIELDS = SCORING_FIELDS + EXTRA_FIELDS
+# Added to the scoring tier when review sentiment counts towards the ranking.
+SENTIMENT_FIELDS = ["reviews"]
+
+places_details_cache = PersistentCache("places_details", default_ttl=PLACES_DETAILS_TTL)
+
+logger = logging.getLogger(__name__)
+
 @dataclass
 class PubData:
     name: str
@@ -24,6 +49,8 @@ class PubData:
     photo_reference: str = ""
     reviews: dict = ""
     nearby_crimes: int = 0
+    sentiment: float = 0.0  # mean Vader compound score of the reviews, see nlp.SentimentEngine
+    extras_loaded: bool = False  # whether the EXTRA_FIELDS details have been fetched
 
     def __str__(self):
         return (f"Pub: {self.name}\n"
@@ -42,65 +69,107 @@ def get_pubs(api_key: str, latitude: float, longitude: float, radius_km: int) ->
     Fetches pubs from Google Places API using a search query and includes detailed information 
     from Contact and Atmosphere categories within a given radius.
     """
-    gmaps = googlemaps.Client(key=api_key)
+    gmaps = new_client(api_key)
 
-    places = gmaps.places_nearby(
-        location=(latitude, longitude),
-        radius=2000,  # radius in meters; adjust as needed
-        type="bar",  # use 'bar' as the type to capture pubs
-        keyword="pub"
-    )
+    with span("places_search"):
+        places = search_places(gmaps, latitude, longitude, radius_km)
+
+    pubs = [pub_from_place(place, latitude, longitude) for place in places]
+    pubs = filter_pubs_within_radius(pubs, latitude, longitude, radius_km)
+    # Fetch detailed information for each pub
+    with span("place_details"):
+        fetch_place_details(gmaps, pubs)
+    return pubs
 
-    pubs = []
-    for place in places.get("results", []):
-        pub_name = place.get("name", "Unknown Pub")
-        lat, lon = place["geometry"]["location"].values()
-        address = place.get("vicinity", "Unknown Address")
-        place_id = place.get("place_id", "")
-        
-        # Fetch detailed information for each pub
-        place_details = gmaps.place(
-            place_id=place_id,
-            fields=["formatted_address", "formatted_phone_number", "international_phone_number", "opening_hours", 
-                    "website", "rating", "user_ratings_total", "photo", "serves_beer", 
-                    "serves_breakfast", "serves_brunch", "serves_dinner", "serves_lunch", "serves_vegetarian_food",
-                    "reviews"]
-        )
-        
-        details = place_details.get("result", {})
-        rating = details.get("rating", 0.0)
-        user_ratings_total = details.get("user_ratings_total", 0)
-        phone_number = details.get("formatted_phone_number", "Unknown Phone Number")
-        website = details.get("website", "Unknown Website")
-        reviews = details.get("reviews", [])  # This will be a list of review dictionaries
+def pub_from_place(place: dict, latitude: float, longitude: float) -> PubData:
+    """
+    Builds a PubData from a nearby search result, before any Place Details are known.
+    'latitude' and 'longitude' are the search origin, used for the pub's distance.
+    The search result's rating stands in until (or unless) the details are fetched.
+    """
+    lat, lon = place["geometry"]["location"].values()
+    # Calculate distance
+    distance = geodesic((latitude, longitude), (lat, lon)).km
+    return PubData(
+        name=place.get("name", "Unknown Pub"),
+        latitude=lat,
+        longitude=lon,
+        address=place.get("vicinity", "Unknown Address"),
+        source="Google",
+        distance_km=round(distance, 2),
+        place_id=place.get("place_id", ""),
+        rating=place.get("rating", 0),
+        user_ratings_total=place.get("user_ratings_total", 0)
+    )
 
+def apply_place_details(pub: PubData, details: dict, fields: list[str] = DETAIL_FIELDS) -> PubData:
+    """
+    Fills in a pub's rating, contact and review fields from a Place Details result.
+    Only the pub fields backed by the requested 'fields' are touched, so the scoring
+    and extra tiers can be applied separately.
+    """
+    if "rating" in fields:
+        pub.rating = details.get("rating", 0.0)
+    if "user_ratings_total" in fields:
+        pub.user_ratings_total = details.get("user_ratings_total", 0)
+    if "formatted_phone_number" in fields:
+        pub.phone_number = details.get("formatted_phone_number", "Unknown Phone Number")
+    if "website" in fields:
+        pub.website = details.get("website", "Unknown Website")
+    if "reviews" in fields:
+        pub.reviews = details.get("reviews", [])  # This will be a list of review dictionaries
+    if "photo" in fields:
         # Optionally, check for photos (only first photo reference for now)
-        photo_reference = details.get("photos", [{}])[0].get("photo_reference", "")
-        
-        # Calculate distance
-        distance = geodesic((latitude, longitude), (lat, lon)).km
-        pubs.append(PubData(
-            name=pub_name,
-            latitude=lat,
-            longitude=lon,
-            address=address,
-            source="Google",
-            distance_km=round(distance, 2),
-            rating=rating,
-            user_ratings_total=user_ratings_total,
-            phone_number=phone_number,
-            website=website,
-            photo_reference=photo_reference,
-            reviews = reviews
-        ))
-
-    for review in reviews:
-        print(review.get("author_name"))
-        print(review.get("rating"))
-        print(review.get("text"))
-        print(review.get("time"))
+        pub.photo_reference = details.get("photos", [{}])[0].get("photo_reference", "")
+    if all(field in fields for field in EXTRA_FIELDS):
+        pub.extras_loaded = True
+    return pub
 
-    pubs = filter_pubs_within_radius(pubs, latitude, longitude, radius_km)
+def details_key(place_id: str, fields: list[str]) -> str:
+    return f"{place_id}:{','.join(sorted(fields))}"
+
+def get_place_details_cached(gmaps: googlemaps.Client, place_id: str, fields: list[str] = DETAIL_FIELDS) -> dict:
+    """
+    Fetches Place Details for a single place, reusing a cached result keyed by place_id
+    and the requested fields.
+    """
+    key = details_key(place_id, fields)
+    details = places_details_cache.get(key)
+    if details is not None:
+        return details
+
+    details = call_with_backoff("places_details", gmaps.place, place_id=place_id, fields=fields).get("result", {})
+    places_details_cache.set(key, details)
+    return details
+
+def fetch_place_details(gmaps: googlemaps.Client, pubs: list[PubData], fields: list[str] = DETAIL_FIELDS,
+                        max_workers: int = DETAILS_WORKERS) -> list[PubData]:
+    """
+    Fetches the given Place Details fields for every pub concurrently (rate limited, with
+    retries on OVER_QUERY_LIMIT) and applies them to the pubs in their original order.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        all_details = list(executor.map(lambda pub: get_place_details_cached(gmaps, pub.place_id, fields), pubs))
+    for pub, details in zip(pubs, all_details):
+        apply_place_details(pub, details, fields)
+    return pubs
+
+def load_pub_extras(gmaps: googlemaps.Client, pubs: list[PubData], budget: CallBudget = None) -> list[PubData]:
+    """
+    Fetches the contact, atmosphere, review and photo fields for any of the given pubs
+    that only have their scoring fields so far. Meant for the pubs on the chosen crawl.
+    With a budget, pubs are taken in the given order and any past it go without.
+    """
+    needed = []
+    for pub in pubs:
+        if pub.extras_loaded:
+            continue
+        if (budget is None or details_key(pub.place_id, EXTRA_FIELDS) in places_details_cache
+                or budget.take("places_details")):
+            needed.append(pub)
+        else:
+            budget.degrade("pub_extras")
+    fetch_place_details(gmaps, needed, EXTRA_FIELDS)
     return pubs
 
 def filter_pubs_within_radius(pubs: list, latitude: float, longitude: float, search_radius_km: float) -> list:
@@ -143,50 +212,61 @@ def normalize_pub_ratings(pubs: list[PubData]) -> list[PubData]:
 
     return pubs
 
-def get_unique_crimes_for_pubs(pubs: list[PubData], date="2024-01") -> list:
+def get_unique_crimes_for_pubs(pubs: list[PubData], date="2024-01", margin_km: float = 1.0,
+                               budget: CallBudget = None) -> list:
     """
-    For each pub, fetch crimes around its location (using the police API, which returns crimes within ~1km)
-    and combine them into a unique list (removing duplicates based on crime 'id').
+    Fetch every crime within 'margin_km' of any pub (using the police API's custom area queries
+    over the pubs' bounding area) as a unique list (duplicates removed based on crime 'id').
     """
-    unique_crimes = {}
-    for pub in pubs:
-        crimes = get_crimes_by_point(pub.latitude, pub.longitude, date=date)
-        if crimes:
-            for crime in crimes:
-                crime_id = crime.get("id")
-                # Use the crime id as the unique key; if missing, you could combine other fields
-                if crime_id and crime_id not in unique_crimes:
-                    unique_crimes[crime_id] = crime
-    return list(unique_crimes.values())
+    return get_crimes_for_area([(pub.latitude, pub.longitude) for pub in pubs], margin_km, date=date,
+                               budget=budget)
 
-def count_crimes_near_pub(pub: PubData, crimes: list, threshold_km: float = 0.3) -> int:
+def build_crime_index(crimes: list) -> GridIndex:
     """
-    Count how many crimes from the deduplicated list fall within 'threshold_km' of the pub.
+    Build a spatial index over the crimes' locations, skipping crimes whose
+    location data is missing or invalid.
     """
-
-    count = 0
+    points = []
     for crime in crimes:
         try:
-            crime_lat = float(crime["location"]["latitude"])
-            crime_lng = float(crime["location"]["longitude"])
+            points.append((float(crime["location"]["latitude"]), float(crime["location"]["longitude"])))
         except (KeyError, ValueError):
             continue  # Skip if location data is missing or invalid
-        distance = geodesic((pub.latitude, pub.longitude), (crime_lat, crime_lng)).km
-        if distance <= threshold_km:
-            count += 1
-            pub.nearby_crimes += 1
+    return GridIndex(points)
 
-    pub.rating = int((pub.rating * RATING_WEIGHT) - RATING_OFFSET)
-    print(f"Crimes near {pub.name} : {count} (rating is {pub.rating}) (normalizes to {pub.rating - count})")
+def normalized_rating(rating: float) -> int:
+    """
+    Rescale a star rating (plus any sentiment) to the points crimes are subtracted from.
+    """
+    return int((rating * RATING_WEIGHT) - RATING_OFFSET)
+
+def record_crime_count(pub: PubData, count: int) -> int:
+    """
+    Store the number of crimes near a pub and apply the rating rescale that goes with it.
+    """
+    pub.nearby_crimes += count
+    pub.rating = normalized_rating(pub.rating)
+    logger.debug("Crimes near %s : %d (rating is %s) (normalizes to %s)", pub.name, count, pub.rating, pub.rating - count)
     return count
 
+def count_crimes_near_pub(pub: PubData, crimes: list, threshold_km: float = 0.3, index: GridIndex = None) -> int:
+    """
+    Count how many crimes from the deduplicated list fall within 'threshold_km' of the pub.
+    Pass a prebuilt index from build_crime_index to avoid re-indexing the crimes for every pub.
+    """
+    index = index or build_crime_index(crimes)
+    return record_crime_count(pub, index.count_within(pub.latitude, pub.longitude, threshold_km * 1000))
+
 def adjust_pub_ratings_for_crime(pubs: list[PubData], crimes: list, threshold_km: float = 1.0, penalty_per_crime: float = CRIME_PENALTY):
     """
     For each pub, count the number of nearby crimes (within threshold_km) and subtract a penalty
     from the pub's normalized rating. Also record the crime count in the pub data.
+    All pubs are counted in one batched query against a spatial index of the crimes.
     """
-    for pub in pubs:
-        crime_count = count_crimes_near_pub(pub, crimes, threshold_km)
+    index = build_crime_index(crimes)
+    counts = index.count_within_many([(pub.latitude, pub.longitude) for pub in pubs], threshold_km * 1000)
+    for pub, crime_count in zip(pubs, counts):
+        record_crime_count(pub, crime_count)
         pub.crime_count = crime_count
         pub.rating = pub.rating - crime_count
 
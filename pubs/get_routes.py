@@ -1,47 +1,26 @@
 # get_routes.py
 
-import datetime
 from dataclasses import is_dataclass, asdict
 
-import googlemaps
-import re
+import logging
 import math
 from geopy.distance import geodesic
-from concurrent.futures import ThreadPoolExecutor
-from get_pubs import PubData, get_pubs, normalize_pub_ratings, get_unique_crimes_for_pubs, adjust_pub_ratings_for_crime
-from api_key import API_KEY
-from visualise import visualize_graph
-from route import Route, Pub  # Import your dataclasses for route segments
-import polyline  # used to decode encoded polylines
+from get_pubs import PubData
+from route import Route  # Import your dataclasses for route segments
 import json
 from graph import UndirectedGraph
 from location import Location
-
-gmaps = googlemaps.Client(key=API_KEY)
-
-EDGE_WEIGHT = 1
-WARRIOR_MODE = False
-VISIT_BAD_PUBS = False
-WALKING_PREFERENCE = 2
+from edge_costs import EdgeCostProvider
+from neighbours import candidate_pairs
+from search import ANGLE_THRESHOLD
+from metrics import ROUTES_ENUMERATED
 
 MAX_PUBS = 6
 
-
-def get_vertex_weight(current: Location) -> float:
-
-    if VISIT_BAD_PUBS or WARRIOR_MODE:
-        return -current.attr["rating"]
-    elif not VISIT_BAD_PUBS:
-        return current.attr["rating"]
+logger = logging.getLogger(__name__)
 
 
-import math
-
-# Add a constant for the maximum allowed turning angle (in radians).
-# (Adjust the threshold as desired—here 150° is used.)
-ANGLE_THRESHOLD = math.radians(150)
-
-def get_all_routes_from_vertex(graph, start):
+def get_all_routes_from_vertex(graph, start, vertex_weight, edge_weight: float):
     """
     Given an undirected graph and a starting vertex,
     return all simple routes (paths) starting at that vertex that contain
@@ -88,7 +67,7 @@ def get_all_routes_from_vertex(graph, start):
                             continue
 
                 # Update the weight and continue the DFS.
-                new_weight = current_weight - (edge_cost * EDGE_WEIGHT) + get_vertex_weight(current)
+                new_weight = current_weight - (edge_cost * edge_weight) + vertex_weight(current)
                 routes.extend(dfs(neighbor, path + [neighbor], new_weight))
         return routes
 
@@ -96,19 +75,47 @@ def get_all_routes_from_vertex(graph, start):
 
 
 
-def get_all_routes(graph):
+def get_all_routes(graph, vertex_weight, edge_weight: float):
     """
     For each vertex in the graph, compute all routes starting from that vertex.
     Returns a dictionary mapping each starting vertex to the list of its routes.
     """
     all_routes = {}
     for vertex in graph.vertices():
-        all_routes[vertex] = get_all_routes_from_vertex(graph, vertex)
-        gl_routes = []
+        all_routes[vertex] = get_all_routes_from_vertex(graph, vertex, vertex_weight, edge_weight)
 
     return all_routes
 
 
+def select_best_and_worst_routes(graph, vertex_weight, edge_weight: float) -> tuple:
+    """
+    Enumerate every route with get_all_routes and scan for the best and worst by weight.
+    Returns (best_route, best_weight, worst_route, worst_weight).
+    """
+    # Get all routes from the graph (each route is a list of vertices with a weight)
+    routes_by_pub = get_all_routes(graph, vertex_weight, edge_weight)
+    gl_routes = []
+    for start_pub, routes_list in routes_by_pub.items():
+        for route, w in routes_list:
+            gl_routes.append((route, w))
+
+    gl_routes = list(filter(lambda route: len(route[0]) <= MAX_PUBS, gl_routes))
+    ROUTES_ENUMERATED.inc(len(gl_routes), method="legacy")
+
+    best_node_w = -math.inf
+    worst_node_w = math.inf
+    best_node = None
+    worst_node = None
+    for _r, w in gl_routes:
+        if w > best_node_w:
+            best_node_w = w
+            best_node = _r
+        if w < worst_node_w:
+            worst_node_w = w
+            worst_node = _r
+    return best_node, best_node_w, worst_node, worst_node_w
+
+
 def get_nearest_pubs(pub: PubData, pubs: list[PubData], n: int = 3) -> list[PubData]:
     distances = [
         (geodesic((pub.latitude, pub.longitude), (other_pub.latitude, other_pub.longitude)).km, other_pub)
@@ -118,71 +125,13 @@ def get_nearest_pubs(pub: PubData, pubs: list[PubData], n: int = 3) -> list[PubD
     return [other_pub for _, other_pub in distances[:n]]
 
 
-def get_route(start: PubData, end: PubData, gmaps: googlemaps.Client, routes_cache: set) -> tuple:
-    directions = gmaps.directions(
-        origin=(start.latitude, start.longitude),
-        destination=(end.latitude, end.longitude),
-        mode="walking",
-        departure_time=datetime.datetime.now()
-    )
-
-    if not directions:
-        return None
-
-    route = directions[0]
-    distance = route['legs'][0]['distance']['text']
-    duration = route['legs'][0]['duration']['text']
-    return (start.name, end.name, distance, convert_duration_to_minutes(duration))
-
-
-def convert_duration_to_minutes(duration_str: str) -> int:
-    time_match = re.match(r"(\d+)\s*(min|mins|minute|minutes|hour|hours|h)", duration_str.lower())
-    if time_match:
-        quantity = int(time_match.group(1))
-        unit = time_match.group(2)
-        return quantity if unit in ["min", "mins", "minute", "minutes"] else quantity * 60
-    return 0
-
-
-def get_route_with_polyline(start: Location, end: Location, gmaps: googlemaps.Client):
+def fetch_pub_routes(pubs: list[PubData], provider: EdgeCostProvider) -> list[tuple]:
     """
-    For a given pair of Location objects, request directions (walking)
-    and extract the distance (meters), duration (minutes) and decode the
-    overview polyline into a list of (latitude, longitude) points.
+    Cost the walk from every pub to its nearest neighbours using the given edge cost
+    provider. Each pair of pubs is costed once, even when both are among each
+    other's nearest neighbours.
     """
-    directions = gmaps.directions(
-        origin=(start.latitude, start.longitude),
-        destination=(end.latitude, end.longitude),
-        mode="walking",
-        departure_time=datetime.datetime.now()
-    )
-    if not directions:
-        return None
-    route_info = directions[0]
-    leg = route_info['legs'][0]
-    distance = leg['distance']['value']  # distance in meters
-    duration_seconds = leg['duration']['value']
-    duration_minutes = duration_seconds // 60
-    polyline_str = route_info.get('overview_polyline', {}).get('points', '')
-    points = polyline.decode(polyline_str) if polyline_str else []
-    return distance, duration_minutes, points
-
-
-def fetch_pub_routes(pubs: list[PubData]) -> list[tuple]:
-    routes_cache = set()
-    routes = []
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_route = {}
-        for pub in pubs:
-            nearest_pubs = get_nearest_pubs(pub, pubs)
-            for nearest_pub in nearest_pubs:
-                future = executor.submit(get_route, pub, nearest_pub, gmaps, routes_cache)
-                future_to_route[future] = (pub, nearest_pub)
-        for future in future_to_route:
-            result = future.result()
-            if result:
-                routes.append(result)
-    return routes
+    return provider.get_routes(candidate_pairs(pubs))
 
 
 def create_graph_from_routes(routes: list[tuple[str, str, str, str]], pubs: list[PubData]) -> tuple[UndirectedGraph, dict]:
@@ -200,7 +149,8 @@ def create_graph_from_routes(routes: list[tuple[str, str, str, str]], pubs: list
                 "rating": pub.rating,
                 "user_ratings_total": pub.user_ratings_total,
                 "phone_number": pub.phone_number,
-                "photo_reference": pub.photo_reference
+                "photo_reference": pub.photo_reference,
+                "nearby_crimes": pub.nearby_crimes
             }
         )
         for pub in pubs
@@ -215,7 +165,8 @@ def create_graph_from_routes(routes: list[tuple[str, str, str, str]], pubs: list
     return g, pub_map
 
 
-def add_shortest_edges_to_connect_graph(graph: UndirectedGraph, pubs: list[Location], pub_map) -> UndirectedGraph:
+def add_shortest_edges_to_connect_graph(graph: UndirectedGraph, pubs: list[Location], pub_map,
+                                        provider: EdgeCostProvider) -> UndirectedGraph:
     # Simple approach to ensure the graph is connected:
     connected_pubs = set()
 
@@ -227,7 +178,7 @@ def add_shortest_edges_to_connect_graph(graph: UndirectedGraph, pubs: list[Locat
                 dfs(neighbor[0], visited)
 
     visited = set()
-    print(graph.vertices())
+    logger.debug("Connecting graph of %d pubs", len(graph.vertices()))
     starting_vertex = graph.vertices()[0]
     dfs(starting_vertex, visited)
     for pub in pubs:
@@ -241,123 +192,21 @@ def add_shortest_edges_to_connect_graph(graph: UndirectedGraph, pubs: list[Locat
                      next(p for p in pubs if p.name == connected_pub).longitude)
                 ).km
             )
-            new_route = get_route(pub_map[nearest_pub], pub_map[pub.name], gmaps, set())
-            if new_route:
+            new_routes = provider.get_routes([(pub_map[nearest_pub], pub_map[pub.name])])
+            if new_routes:
+                new_route = new_routes[0]
                 graph.add_edge(pub_map[nearest_pub], pub_map[pub.name], new_route[3])
     return graph
 
 
 def main_router(lat, long, attr, show = False) -> list[Route]:
     """
-    Main routine: fetch pubs, build the route graph, select the best route,
-    and then for each consecutive pair of pubs in the best route, call the directions API
-    to retrieve (and decode) the polyline. For each segment a Route object is created.
-    The function returns the list of Route objects for the best route.
+    Plan the best crawl for a request's JSON attributes. Kept for existing callers;
+    the work is done by a request-scoped planner.Planner.
     """
-    global WARRIOR_MODE
-    global WALKING_PREFERENCE
-    global VISIT_BAD_PUBS
-    global EDGE_WEIGHT
-
-    # Configure attributes
-    WARRIOR_MODE = attr["warrior_mode"]
-    print("WARRIOR_MODE is {}".format(WARRIOR_MODE))
-
-    if attr["maximise_rating"] == 1: VISIT_BAD_PUBS = False
-    elif attr["maximise_rating"] == 0: VISIT_BAD_PUBS = True
-    else: print("VISIT_BAD_PUBS Defaulted to False")
-    print("VISIT_BAD_PUBS IS {}".format(VISIT_BAD_PUBS))
-
-    WALKING_PREFERENCE = attr["walking"]
-    print("WALKING PREFERENCE IS {}".format(WALKING_PREFERENCE))
-    match WALKING_PREFERENCE:
-        case 0: EDGE_WEIGHT = 5
-        case 1: EDGE_WEIGHT = 2
-        case 2: EDGE_WEIGHT = 0.3
-    print("EDGE WEIGHT IS {}".format(EDGE_WEIGHT))
-
-    # Get pubs and build graph
-    longitude, latitude  = long, lat
-    radius_km = attr["range"]
-    print(latitude,longitude)
-    pubs = get_pubs(API_KEY, latitude, longitude, radius_km)
-
-    # Now, for each pub we want to incorporate nearby crime:
-    unique_crimes = get_unique_crimes_for_pubs(pubs, date="2024-01")
-    print(f"\nTotal unique crimes found across all pubs: {len(unique_crimes)}")
-
-    if WARRIOR_MODE: crime_penalty = -10
-    else: crime_penalty = 3
-    adjust_pub_ratings_for_crime(pubs, unique_crimes, threshold_km=0.3, penalty_per_crime=crime_penalty)
-
-    routes = fetch_pub_routes(pubs)
-
-    for pub in pubs:
-        if VISIT_BAD_PUBS or WARRIOR_MODE:
-            pub.rating = -pub.rating
-        print(f"{pub.name} is rated {pub.rating}")
-
-
-    graph, pub_map = create_graph_from_routes(routes, pubs)
-    graph = add_shortest_edges_to_connect_graph(graph, pubs, pub_map)
-
-    # Get all routes from the graph (each route is a list of vertices with a weight)
-    routes_by_pub = get_all_routes(graph)
-    gl_routes = []
-    for start_pub, routes_list in routes_by_pub.items():
-        for route, w in routes_list:
-            gl_routes.append((route, w))
-
-    gl_routes = list(filter(lambda route: len(route[0]) <= MAX_PUBS, gl_routes))
-
-    # Select best (and worst) route by weight
-    best_node_w = -math.inf
-    worst_node_w = math.inf
-    best_node = None
-    worst_node = None
-    for _r, w in gl_routes:
-        if w > best_node_w:
-            best_node_w = w
-            best_node = _r
-        if w < worst_node_w:
-            worst_node_w = w
-            worst_node = _r
-
-    # Now build the list of Route objects for the best route.
-    best_route_segments = []
-    if best_node and len(best_node) >= 2:
-        for i in range(len(best_node) - 1):
-            segment_info = get_route_with_polyline(best_node[i], best_node[i + 1], gmaps)
-            if segment_info is not None:
-                distance, time_minutes, points = segment_info
-                # Convert the Location object to a route.Pub object.
-                start_pub = Pub(
-                    name=best_node[i].name,
-                    loc=(best_node[i].latitude, best_node[i].longitude),
-                    rating=best_node[i].attr.get("rating", 0),
-                    photo_reference =best_node[i].attr.get("photo_reference", "")
-                )
-
-                end_pub = Pub(
-                    name=best_node[i + 1].name,
-                    loc=(best_node[i + 1].latitude, best_node[i + 1].longitude),
-                    rating=best_node[i + 1].attr.get("rating", 0),
-                    photo_reference =best_node[i+1].attr.get("photo_reference", "")
-                )
-
-                best_route_segments.append(Route(
-                    start_node=start_pub,
-                    end_node=end_pub,
-                    time=time_minutes,
-                    distance=distance,
-                    route=points
-                ))
-
-    # Optionally, visualize the graph.
-    if show:
-        visualize_graph(graph)
-
-    return best_route_segments
+    # planner imports this module for the graph helpers, so import it on use.
+    from planner import Planner, PlannerConfig
+    return Planner(PlannerConfig.from_attr(attr)).plan(lat, long, show)
 
 
 def dataclass_to_json(obj: any) -> str:
@@ -379,7 +228,8 @@ def dataclass_to_json(obj: any) -> str:
 
 
 if __name__ == "__main__":
-    best_segments = main_router(51.426099, -0.566008)
+    best_segments = main_router(51.426099, -0.566008,
+                                {"maximise_rating": 1, "range": 1, "walking": 2, "warrior_mode": False})
     print("Best route segments (with polyline coordinates):")
     for segment in best_segments:
         print(segment)
@@ -1,3 +1,5 @@
+import math
+from types import MappingProxyType
 from location import Location
 
 class UndirectedGraph:
@@ -154,3 +156,129 @@ class UndirectedGraph:
         automatically setting its vertex weight using `location.get_weight()`.
         """
         self.add_vertex(location, weight=location.get_weight())
+
+
+class CompactGraph:
+    """
+    A frozen, tuple-backed copy of an UndirectedGraph for fast traversal.
+
+    Vertices are numbered 0..n-1 in the order of graph.vertices(), and vertex i's
+    weight is vertex_weights[i]. Adjacency is stored in CSR form: the neighbours of
+    vertex i are neighbours[offsets[i]:offsets[i + 1]], with the matching edge weights
+    at the same positions in edge_weights (each undirected edge appears once in each
+    direction, in the original neighbour order). edge_slot and edge_weight look up
+    the edge between two vertices in O(1).
+
+    Attributes cannot be set or replaced once built; with_vertex_weights gives a copy
+    with other vertex weights that shares everything else.
+    """
+
+    __slots__ = ("vertices", "index", "vertex_weights", "offsets", "neighbours", "edge_weights",
+                 "_slots", "_turn_tables")
+
+    def __init__(self, vertices, offsets, neighbours, edge_weights, vertex_weights=None):
+        vertices = tuple(vertices)
+        offsets = tuple(offsets)
+        neighbours = tuple(neighbours)
+        # (i, j) -> the slot of the edge i -> j in neighbours and edge_weights.
+        slots = {(i, neighbours[slot]): slot
+                 for i in range(len(vertices)) for slot in range(offsets[i], offsets[i + 1])}
+        self._freeze(
+            vertices=vertices,
+            index=MappingProxyType({vertex: i for i, vertex in enumerate(vertices)}),
+            vertex_weights=tuple(vertex_weights) if vertex_weights is not None else (0.0,) * len(vertices),
+            offsets=offsets,
+            neighbours=neighbours,
+            edge_weights=tuple(edge_weights),
+            _slots=MappingProxyType(slots),
+            _turn_tables={},  # by cosine threshold, see turn_table
+        )
+
+    def _freeze(self, **attributes):
+        for name, value in attributes.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"CompactGraph is frozen; cannot set {name!r}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"CompactGraph is frozen; cannot delete {name!r}")
+
+    @classmethod
+    def from_graph(cls, graph: UndirectedGraph) -> "CompactGraph":
+        """Build a CompactGraph, with the graph's vertex weights, from an UndirectedGraph in one pass."""
+        vertices = graph.vertices()
+        index = {vertex: i for i, vertex in enumerate(vertices)}
+        offsets = [0]
+        neighbours = []
+        edge_weights = []
+        for vertex in vertices:
+            for neighbor, weight in graph.get_neighbors(vertex):
+                neighbours.append(index[neighbor])
+                edge_weights.append(weight)
+            offsets.append(len(neighbours))
+        return cls(vertices, offsets, neighbours, edge_weights,
+                   [graph.get_vertex_weight(vertex) for vertex in vertices])
+
+    def with_vertex_weights(self, vertex_weights) -> "CompactGraph":
+        """
+        A copy of this graph with vertex i weighing vertex_weights[i]. The copy shares
+        the vertices, adjacency and turn tables, so making one is O(n).
+        """
+        if len(vertex_weights) != len(self.vertices):
+            raise ValueError(f"Expected {len(self.vertices)} vertex weights, got {len(vertex_weights)}")
+        copy = object.__new__(CompactGraph)
+        copy._freeze(**{name: getattr(self, name) for name in self.__slots__})
+        copy._freeze(vertex_weights=tuple(vertex_weights))
+        return copy
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def edge_slot(self, i: int, j: int):
+        """The slot of the edge from vertex i to vertex j, or None if they are not adjacent."""
+        return self._slots.get((i, j))
+
+    def edge_weight(self, i: int, j: int):
+        """The weight of the edge between vertices i and j, or None if they are not adjacent."""
+        slot = self._slots.get((i, j))
+        return self.edge_weights[slot] if slot is not None else None
+
+    def turn_table(self, cos_threshold: float) -> tuple[tuple, ...]:
+        """
+        For every edge slot u -> v, the slots v -> w that may follow it without turning
+        by more than the angle whose cosine is cos_threshold. Built on first use for
+        each threshold and kept, since it only depends on the (frozen) graph.
+
+        Each leg's direction is reduced once to a unit (latitude, longitude) vector, so a
+        turn is allowed when the dot product of the two unit vectors is at least
+        cos_threshold, with no sqrt or acos in the search itself. Legs of zero length
+        (pubs at the same coordinates) never restrict the turn.
+        """
+        turns = self._turn_tables.get(cos_threshold)
+        if turns is not None:
+            return turns
+
+        offsets, neighbours = self.offsets, self.neighbours
+        units = []
+        for u in range(len(self.vertices)):
+            for slot in range(offsets[u], offsets[u + 1]):
+                v = neighbours[slot]
+                d_lat = self.vertices[v].latitude - self.vertices[u].latitude
+                d_lng = self.vertices[v].longitude - self.vertices[u].longitude
+                norm = math.sqrt(d_lat ** 2 + d_lng ** 2)
+                units.append((d_lat / norm, d_lng / norm) if norm > 0 else None)
+
+        turns = []
+        for slot, unit in enumerate(units):
+            v = neighbours[slot]
+            allowed = []
+            for next_slot in range(offsets[v], offsets[v + 1]):
+                next_unit = units[next_slot]
+                if (unit is None or next_unit is None
+                        or unit[0] * next_unit[0] + unit[1] * next_unit[1] >= cos_threshold):
+                    allowed.append(next_slot)
+            turns.append(tuple(allowed))
+        turns = tuple(turns)
+        self._turn_tables[cos_threshold] = turns
+        return turns
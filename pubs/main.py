@@ -1,14 +1,130 @@
-from flask import Flask, request, jsonify
-from get_routes import main_router
+import logging
+import os
+from flask import Flask, Response, request, jsonify
+from planner import Planner, PlannerConfig, WALKING_EDGE_WEIGHTS, CRIME_DATE, SENTIMENT_WEIGHT
+from budget import CallBudget, REPLAN_CALL_LIMITS
 from flask_cors import CORS
+from cache import LRUCache, SingleFlight, tile_key
+import metrics
+import transport
+
+# Identical requests from (almost) the same spot get the same crawl for a few minutes.
+PLAN_TILE_DEGREES = 0.001  # ~110m north-south
+PLAN_CACHE_TTL = 5 * 60  # seconds
+PLAN_CACHE_SIZE = 256
+
+# What each request fetched about its area is kept for a while, for re-planning it
+# with other options through /replan (see snapshot.py).
+SNAPSHOT_TTL = 30 * 60  # seconds
+SNAPSHOT_STORE_SIZE = 64
+
+# Lists the stages that ran out of call budget (see budget.py), comma separated.
+DEGRADED_HEADER = "X-Pintcrawler-Degraded"
+# The snapshot_id to send to /replan.
+SNAPSHOT_HEADER = "X-Pintcrawler-Snapshot"
+
+# LOG_LEVEL=DEBUG shows per-stage timings and per-pub scores.
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Record or replay Google Maps and police API responses if PINTCRAWLER_TRANSPORT is set.
+transport.install_from_env()
+plan_cache = LRUCache(PLAN_CACHE_SIZE, PLAN_CACHE_TTL, name="plans")
+plan_flight = SingleFlight()
+snapshots = LRUCache(SNAPSHOT_STORE_SIZE, SNAPSHOT_TTL, name="snapshots")
+
+
+def plan_key(request_json: dict) -> str:
+    """
+    Cache key for a crawl request: its quantized position plus every option that
+    changes the plan.
+    """
+    return "|".join([
+        tile_key(float(request_json["lat"]), float(request_json["long"]), PLAN_TILE_DEGREES),
+        str(request_json["maximise_rating"]),
+        str(request_json["range"]),
+        str(request_json["walking"]),
+        str(request_json["warrior_mode"]),
+        str(request_json.get("crime_date", CRIME_DATE)),
+        str(float(request_json.get("sentiment_weight", SENTIMENT_WEIGHT))),
+        str(bool(request_json.get("frontier", False)))
+    ])
+
+
+def planned(planner: Planner, route: list) -> dict:
+    """
+    The result of a plan or re-plan, naming the planner's area snapshot.
+    """
+    result = {"route": route, "degraded": planner.degraded, "snapshot_id": planner.snapshot.snapshot_id}
+    if planner.frontier is not None:
+        result["frontier"] = planner.frontier
+        result["edge_weights"] = WALKING_EDGE_WEIGHTS
+    return result
+
+
+def plan_crawl(request_json: dict) -> dict:
+    """
+    Return the crawl for a request as {"route": [...], "degraded": [...], "snapshot_id": ...}
+    (plus "frontier" and "edge_weights" if the request asks for the frontier), from the
+    plan cache if an identical request was planned recently. Concurrent identical
+    requests share a single computation.
+    """
+    key = plan_key(request_json)
+
+    def compute():
+        # Another request may have finished planning this between our lookup and now.
+        cached = plan_cache.get(key)
+        if cached is None:
+            planner = Planner(PlannerConfig.from_attr(request_json))
+            cached = (planned(planner, planner.plan(request_json["lat"], request_json["long"])), planner.snapshot)
+            plan_cache.set(key, cached)
+        return cached
+
+    cached = plan_cache.get(key)
+    if cached is None:
+        cached = plan_flight.do(key, compute)
+    result, snapshot = cached
+    # Cached plans keep their snapshot, which the smaller snapshot store may have dropped,
+    # so the snapshot_id they return always works with /replan.
+    snapshots.set(snapshot.snapshot_id, snapshot)
+    return result
+
+
+def respond(request_json: dict, result: dict) -> Response:
+    """
+    The crawl's list of legs, or the whole result if the request sets "verbose" or
+    "frontier", with the degraded stages and snapshot_id in headers.
+    """
+    verbose = request_json.get("verbose") or request_json.get("frontier")
+    response = jsonify(result if verbose else result["route"])
+    if result["degraded"]:
+        response.headers[DEGRADED_HEADER] = ",".join(result["degraded"])
+    response.headers[SNAPSHOT_HEADER] = result["snapshot_id"]
+    return response
+
 
 @app.route('/', methods=['POST'])
 def hello_http():
     """
     Endpoint that mimics the behavior of your Cloud Function.
     Expects a JSON payload with "lat" and "long" keys.
+    Responds with the crawl's list of legs, or with {"route": [...], "degraded": [...],
+    "snapshot_id": ...} if the payload sets "verbose". Degraded stages are also listed
+    in DEGRADED_HEADER, and the snapshot_id (for /replan) is in SNAPSHOT_HEADER.
+    "crime_date" ("YYYY-MM") picks the month crimes are counted from, and
+    "sentiment_weight" the stars added to each pub's rating per unit of the mean
+    sentiment (-1..+1) of its reviews (default SENTIMENT_WEIGHT; 0 ignores reviews).
+
+    A payload with "frontier" set gets the same object with the Pareto-optimal crawls
+    under "frontier" ("peacekeeper": higher rating and lower crime are better,
+    "warrior": the opposite; shorter is better in both) and the edge weight of each
+    "walking" value under "edge_weights", so a new weighting of rating, crime and
+    time can be applied by the client without another request
+    (see planner.Planner).
     """
     request_json = request.get_json(silent=True)
 
@@ -24,18 +140,80 @@ def hello_http():
     missing = False
     for param in required_params:
         if param not in request_json:
-            print(f"{param} missing from JSON")
+            logger.warning("%s missing from JSON", param)
             missing = True
         if missing:
+            metrics.REQUESTS.inc(status="400")
             return jsonify({"error": 100}), 400
 
-    result = main_router(request_json["lat"], request_json["long"], request_json)
-    return jsonify(result)
+    try:
+        with metrics.span("request"):
+            result = plan_crawl(request_json)
+    except Exception:
+        metrics.REQUESTS.inc(status="500")
+        raise
+    metrics.REQUESTS.inc(status="200")
+    return respond(request_json, result)
+
+
+@app.route('/replan', methods=['POST'])
+def replan_http():
+    """
+    Plan an area again with other options, from the snapshot an earlier request left.
+    Expects a JSON payload with "snapshot_id", "maximise_rating", "walking" and
+    "warrior_mode", and optionally "crime_date", "sentiment_weight" and
+    "frontier"/"verbose" as for "/". Sentiment only counts if the snapshot's own
+    request set a sentiment weight, since reviews are not fetched otherwise.
+    Only scoring and the route search run again, plus the new crawl's legs and
+    extras and, for a new "crime_date", that month's crimes (within REPLAN_CALL_LIMITS).
+    Responds as "/" does, or with 404 if the snapshot has expired: plan with "/" again.
+    A new "crime_date" gives a new snapshot, whose snapshot_id the response carries.
+    """
+    request_json = request.get_json(silent=True) or {}
+
+    required_params = [
+        "snapshot_id",
+        "maximise_rating",
+        "walking",
+        "warrior_mode"
+    ]
+    missing = [param for param in required_params if param not in request_json]
+    if missing:
+        logger.warning("%s missing from JSON", ", ".join(missing))
+        metrics.REQUESTS.inc(status="400")
+        return jsonify({"error": 100}), 400
+
+    snapshot = snapshots.get(request_json["snapshot_id"])
+    if snapshot is None:
+        metrics.REQUESTS.inc(status="404")
+        return jsonify({"error": 101}), 404
+
+    try:
+        with metrics.span("replan"):
+            config = PlannerConfig.from_attr({**request_json, "range": snapshot.radius_km})
+            planner = Planner(config, budget=CallBudget(REPLAN_CALL_LIMITS))
+            result = planned(planner, planner.replan(snapshot))
+        snapshots.set(planner.snapshot.snapshot_id, planner.snapshot)
+    except Exception:
+        metrics.REQUESTS.inc(status="500")
+        raise
+    metrics.REQUESTS.inc(status="200")
+    return respond(request_json, result)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Stage timings, upstream calls, cache lookups and routes enumerated, in the
+    Prometheus text exposition format.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 CORS(app, 
      resources={r"/*": {"origins": "*"}},
      supports_credentials=True,
-     allow_headers=["Content-Type", "Authorization", "Access-Control-Allow-Origin"])
+     allow_headers=["Content-Type", "Authorization", "Access-Control-Allow-Origin"],
+     expose_headers=[DEGRADED_HEADER, SNAPSHOT_HEADER])
 if __name__ == '__main__':
     # Run the server in debug mode on host 0.0.0.0 and port 5000.
     app.run(debug=True, host='0.0.0.0', port=5069)
@@ -0,0 +1,130 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets (seconds) for stage timings, from a cached lookup up to a slow plan.
+STAGE_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Counts observations into cumulative buckets, with their sum, split by labels."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: list = STAGE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = sorted(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(labels[name] for name in self.labelnames))
+        return sum(series[:-1]) if series else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ["+Inf"], series[:-1]):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == "+Inf" else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format."""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "pintcrawler_stage_seconds", "Time spent in each planning stage.", ("stage",))
+UPSTREAM_CALLS = Counter(
+    "pintcrawler_upstream_calls_total", "Calls to Google Maps and the police API, by outcome.",
+    ("upstream", "outcome"))
+CACHE_LOOKUPS = Counter(
+    "pintcrawler_cache_lookups_total", "Cache lookups, by cache and hit or miss.", ("cache", "result"))
+ROUTES_ENUMERATED = Counter(
+    "pintcrawler_routes_enumerated_total", "Complete crawls scored by the route search.", ("method",))
+REQUESTS = Counter(
+    "pintcrawler_requests_total", "Planning requests served, by HTTP status.", ("status",))
+DEGRADED = Counter(
+    "pintcrawler_degraded_total", "Requests that ran out of call budget, by degraded stage.", ("stage",))
+
+
+@contextmanager
+def span(stage: str):
+    """Time the enclosed block as one observation of 'stage'."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        logger.debug("stage %s took %.3fs", stage, elapsed)
+
+
+def timed(stage: str, func):
+    """Wrap func so that every call is timed as a span of 'stage'."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(stage):
+            return func(*args, **kwargs)
+    return wrapper
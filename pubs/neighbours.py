@@ -0,0 +1,57 @@
+import numpy as np
+from spatial import GridIndex
+
+EARTH_RADIUS_M = 6371008.8
+
+# Up to this many pubs a full distance matrix is cheapest; above it, use the grid index.
+DENSE_MAX_PUBS = 300
+
+
+def haversine_matrix(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """
+    Return the N x N matrix of great-circle distances (metres) between the given points.
+    """
+    lat = np.radians(latitudes)
+    lon = np.radians(longitudes)
+    d_lat = lat[:, None] - lat[None, :]
+    d_lon = lon[:, None] - lon[None, :]
+    a = np.sin(d_lat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(d_lon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def nearest_neighbours(points: list[tuple[float, float]], k: int) -> list[list[int]]:
+    """
+    For every (latitude, longitude) point, return the indices of its k nearest
+    other points, nearest first.
+    """
+    n = len(points)
+    if n <= 1:
+        return [[] for _ in range(n)]
+    k = min(k, n - 1)
+
+    if n <= DENSE_MAX_PUBS:
+        coords = np.asarray(points, dtype=float)
+        distances = haversine_matrix(coords[:, 0], coords[:, 1])
+        np.fill_diagonal(distances, np.inf)
+        return np.argsort(distances, axis=1, kind="stable")[:, :k].tolist()
+
+    index = GridIndex(points)
+    return [index.nearest(lat, lon, k, exclude=i) for i, (lat, lon) in enumerate(points)]
+
+
+def candidate_pairs(pubs: list, k: int = 3) -> list[tuple]:
+    """
+    Return the (pub, neighbour) pairs to cost when building the route graph: each pub
+    paired with its k nearest neighbours, with symmetric duplicates removed so a
+    pair is only requested once in whichever direction it is first seen.
+    """
+    neighbours = nearest_neighbours([(pub.latitude, pub.longitude) for pub in pubs], k)
+    seen = set()
+    pairs = []
+    for i, nearest in enumerate(neighbours):
+        for j in nearest:
+            key = (min(i, j), max(i, j))
+            if key not in seen:
+                seen.add(key)
+                pairs.append((pubs[i], pubs[j]))
+    return pairs
@@ -1,25 +1,125 @@
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
 import nltk
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 from nltk.stem import WordNetLemmatizer
 
+# Vader's recommended threshold: compound scores at or above it are positive.
+POSITIVE_THRESHOLD = 0.05
+# Batches smaller than this are scored in-process; a process pool costs more than it saves.
+PARALLEL_MIN_REVIEWS = 200
+MEMO_MAX_ENTRIES = 50000
 
-# Preprocessing function: tokenize, remove stop words, and lemmatize
-def preprocess_text(text):
-    # Convert text to lowercase and tokenize
-    tokens = word_tokenize(text.lower())
 
-    # Remove stopwords (you can extend this list if needed)
-    filtered_tokens = [token for token in tokens if token not in stopwords.words('english')]
+def review_key(text: str) -> str:
+    """Memo key for a review: a hash of its text."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class SentimentEngine:
+    """
+    Scores review sentiment with Vader. The analyzer, lemmatizer and stopword set are
+    loaded once per engine, and compound scores are memoized by review text hash,
+    so a review seen before (e.g. on another request for the same pub) costs nothing.
+    """
+
+    def __init__(self):
+        self.analyzer = SentimentIntensityAnalyzer()
+        self.lemmatizer = WordNetLemmatizer()
+        self.stop_words = set(stopwords.words('english'))
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def preprocess(self, text: str) -> str:
+        """Tokenize, remove stop words and lemmatize, returning the tokens joined by spaces."""
+        tokens = word_tokenize(text.lower())
+        return ' '.join(self.lemmatizer.lemmatize(token) for token in tokens if token not in self.stop_words)
+
+    def _compound(self, text: str) -> float:
+        return self.analyzer.polarity_scores(self.preprocess(text))['compound']
+
+    def score(self, text: str) -> float:
+        """Vader compound score of one review, between -1 (negative) and +1 (positive)."""
+        return self.score_many([text])[0]
+
+    def score_many(self, texts: list[str], workers: int = 1) -> list[float]:
+        """
+        Compound scores for a batch of reviews, in order. Each distinct review not
+        already memoized is scored once; with workers > 1 (and at least
+        PARALLEL_MIN_REVIEWS of them) they are split across a process pool.
+        """
+        keys = [review_key(text) for text in texts]
+        known, todo = {}, {}
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in self._memo:
+                    known[key] = self._memo[key]
+                else:
+                    todo[key] = text
+
+        if workers > 1 and len(todo) >= PARALLEL_MIN_REVIEWS:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                scores = list(executor.map(_score_in_worker, todo.values(), chunksize=64))
+        else:
+            scores = [self._compound(text) for text in todo.values()]
+
+        known.update(zip(todo.keys(), scores))
+        with self._lock:
+            if len(self._memo) + len(todo) > MEMO_MAX_ENTRIES:
+                self._memo.clear()
+            self._memo.update(zip(todo.keys(), scores))
+        return [known[key] for key in keys]
+
+    def score_pubs(self, pubs: list, workers: int = 1) -> list:
+        """
+        Score every review of every pub in one batch and set each pub's 'sentiment' to
+        the mean compound score of its reviews (0.0 for a pub without reviews).
+        """
+        texts = []
+        spans = []
+        for pub in pubs:
+            reviews = [review.get("text", "") for review in pub.reviews or [] if review.get("text")]
+            spans.append((len(texts), len(texts) + len(reviews)))
+            texts.extend(reviews)
+
+        scores = self.score_many(texts, workers)
+        for pub, (start, end) in zip(pubs, spans):
+            pub.sentiment = sum(scores[start:end]) / (end - start) if end > start else 0.0
+        return pubs
 
-    # Lemmatize tokens to reduce them to their base form
-    lemmatizer = WordNetLemmatizer()
-    lemmatized_tokens = [lemmatizer.lemmatize(token) for token in filtered_tokens]
 
-    # Reconstruct the processed tokens back into a string
-    processed_text = ' '.join(lemmatized_tokens)
-    return processed_text
+# Each worker process builds its own engine once, when the pool starts.
+_worker_engine = None
+
+
+def _init_worker():
+    global _worker_engine
+    _worker_engine = SentimentEngine()
+
+
+def _score_in_worker(text: str) -> float:
+    return _worker_engine._compound(text)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> SentimentEngine:
+    """Return the shared SentimentEngine, loading it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = SentimentEngine()
+        return _engine
+
+
+# Preprocessing function: tokenize, remove stop words, and lemmatize
+def preprocess_text(text):
+    return get_engine().preprocess(text)
 
 
 # Thematic analysis function: returns "Positive" or "Negative" based on review sentiment
@@ -33,18 +133,7 @@ def thematic_analysis(review):
     Returns:
         str: "Positive" if the sentiment is positive, otherwise "Negative".
     """
-    # Preprocess the review text
-    processed_review = preprocess_text(review)
-
-    # Initialize the Vader sentiment analyzer
-    analyzer = SentimentIntensityAnalyzer()
-
-    # Get the sentiment scores
-    scores = analyzer.polarity_scores(processed_review)
-
-    # Vader provides a compound score between -1 (most negative) and +1 (most positive)
-    # We use a threshold of 0.05 for positive sentiment, per Vader's recommendation.
-    if scores['compound'] >= 0.05:
+    if get_engine().score(review) >= POSITIVE_THRESHOLD:
         return "Positive"
     else:
         return "Negative"
@@ -0,0 +1,162 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import googlemaps
+from budget import CallBudget
+from directions import is_leg_cached, get_route_with_polyline
+from edge_costs import EdgeCostProvider, StraightLineCostProvider
+from graph import CompactGraph
+from metrics import STAGE_SECONDS, timed
+from get_pubs import (PubData, pub_from_place, apply_place_details, DETAILS_WORKERS,
+                      get_place_details_cached, filter_pubs_within_radius, get_unique_crimes_for_pubs,
+                      DETAIL_FIELDS, load_pub_extras, details_key, places_details_cache)
+from neighbours import candidate_pairs
+from places import search_places, SEARCH_WORKERS
+
+# How many requests may be in flight at once against each upstream (the request rate
+# itself is capped by the token buckets in ratelimit.py).
+DETAILS_CONCURRENCY = DETAILS_WORKERS
+DIRECTIONS_CONCURRENCY = 5
+
+# Shared by every pipeline run. The Google and police clients are blocking, so each
+# call runs on this pool while asyncio schedules and overlaps the stages.
+executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="pipeline")
+
+
+async def _run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+async def _stream_pubs(gmaps: googlemaps.Client, latitude: float, longitude: float, radius_km: float,
+                      fields: list[str], limit: int,
+                      budget: CallBudget = None) -> tuple[list[PubData], asyncio.Future]:
+    """
+    Run the Places search and start fetching each in-range pub's details as soon as
+    the page it is on arrives, rather than after the whole search has finished.
+
+    Returns the pubs, in search order, and a future for their outstanding details.
+    The place_details stage is timed from the first details request until the last
+    one finishes, so it overlaps places_search.
+
+    Pages arrive in search order, so with a budget the pubs that miss out on details
+    (and keep their search result's rating) are always the last ones found.
+    """
+    loop = asyncio.get_running_loop()
+    pages = asyncio.Queue()
+    semaphore = asyncio.Semaphore(limit)
+
+    async def fetch(pub):
+        async with semaphore:
+            apply_place_details(pub, await _run(get_place_details_cached, gmaps, pub.place_id, fields), fields)
+
+    search = asyncio.ensure_future(_run(
+        timed("places_search", search_places), gmaps, latitude, longitude, radius_km,
+        lambda page: loop.call_soon_threadsafe(pages.put_nowait, page), SEARCH_WORKERS, budget
+    ))
+    # Pages are queued on the loop before the search's own result, so this marks the last one.
+    search.add_done_callback(lambda _: pages.put_nowait(None))
+
+    pubs_by_id = {}
+    details = []
+    details_start = None
+    while (page := await pages.get()) is not None:
+        new_pubs = [pub_from_place(place, latitude, longitude) for place in page]
+        # Only coordinates are needed to drop out-of-range pubs, so do it before paying for their details.
+        for pub in filter_pubs_within_radius(new_pubs, latitude, longitude, radius_km):
+            pubs_by_id[pub.place_id] = pub
+            if (budget is not None and details_key(pub.place_id, fields) not in places_details_cache
+                    and not budget.take("places_details")):
+                budget.degrade("place_details")
+                continue
+            if details_start is None:
+                details_start = time.perf_counter()
+            details.append(asyncio.ensure_future(fetch(pub)))
+
+    places = await search
+    pubs = [pubs_by_id[place.get("place_id")] for place in places if place.get("place_id") in pubs_by_id]
+    all_details = asyncio.gather(*details)
+    if details_start is not None:
+        all_details.add_done_callback(
+            lambda _: STAGE_SECONDS.observe(time.perf_counter() - details_start, stage="place_details"))
+    return pubs, all_details
+
+
+async def gather_area(gmaps: googlemaps.Client, latitude: float, longitude: float, radius_km: float,
+                      provider: EdgeCostProvider, crime_radius_km: float, date: str = "2024-01",
+                      fields: list[str] = DETAIL_FIELDS, budget: CallBudget = None) -> tuple:
+    """
+    Collect everything the planner needs about an area: the pubs (with the requested
+    Place Details fields), the crimes around them and the walking times between
+    neighbouring pubs.
+
+    Details are fetched as the search streams pubs in. Crimes and walking times need
+    the full set of pubs, so they start when the search ends, alongside whatever
+    details are still outstanding, and the total wait is roughly the search plus
+    the slowest of the three.
+
+    The budget (if given) caps the searches, details and crime requests; walking
+    times are capped by the provider's own budget.
+
+    Returns (pubs, crimes, routes).
+    """
+    pubs, details = await _stream_pubs(gmaps, latitude, longitude, radius_km, fields, DETAILS_CONCURRENCY,
+                                       budget)
+
+    _, crimes, routes = await asyncio.gather(
+        details,
+        _run(timed("crimes", get_unique_crimes_for_pubs), pubs, date, crime_radius_km, budget),
+        _run(timed("walking_times", provider.get_routes), candidate_pairs(pubs))
+    )
+    return pubs, crimes, routes
+
+
+def straight_segment(start, end, minutes: float = None) -> tuple:
+    """
+    Stand-in for a walking leg once the directions budget is spent: a straight line
+    between the stops with a StraightLineCostProvider estimate of its length and, unless
+    'minutes' is given, of its time.
+    """
+    _, _, distance, estimate = StraightLineCostProvider().get_routes([(start, end)])[0]
+    return (distance, estimate if minutes is None else minutes,
+            [(start.latitude, start.longitude), (end.latitude, end.longitude)])
+
+
+async def fetch_segments(gmaps: googlemaps.Client, stops: list, budget: CallBudget = None,
+                         graph: CompactGraph = None) -> list:
+    """
+    Fetch the walking leg (distance, minutes, polyline points) between each pair of
+    consecutive stops concurrently. Entries are None where no route was found.
+    With a budget, legs are paid for in crawl order and any past it are straight lines,
+    timed by their edge in 'graph' (the walking times the crawl was planned with) if given.
+    """
+    semaphore = asyncio.Semaphore(DIRECTIONS_CONCURRENCY)
+
+    def planned_minutes(start, end):
+        if graph is None:
+            return None
+        return graph.edge_weight(graph.index[start], graph.index[end])
+
+    async def fetch(start, end):
+        if budget is not None and not is_leg_cached(start, end, with_polyline=True) and not budget.take("directions"):
+            budget.degrade("polylines")
+            return straight_segment(start, end, planned_minutes(start, end))
+        async with semaphore:
+            return await _run(get_route_with_polyline, start, end, gmaps)
+
+    started = time.perf_counter()
+    segments = await asyncio.gather(*(fetch(start, end) for start, end in zip(stops, stops[1:])))
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="polylines")
+    return segments
+
+
+async def finish_crawl(gmaps: googlemaps.Client, stops: list, stop_pubs: list[PubData],
+                       budget: CallBudget = None, graph: CompactGraph = None) -> list:
+    """
+    Fetch what is only needed for the chosen crawl: the legs between its stops
+    (as fetch_segments) and, at the same time, the extra Place Details of its pubs.
+    """
+    segments, _ = await asyncio.gather(
+        fetch_segments(gmaps, stops, budget, graph),
+        _run(timed("pub_extras", load_pub_extras), gmaps, stop_pubs, budget)
+    )
+    return segments
@@ -0,0 +1,246 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import googlemaps
+from budget import CallBudget
+from cache import PersistentCache, tile_centre
+from ratelimit import call_with_backoff
+from spatial import metres_per_degree
+
+PLACES_SEARCH_TTL = 6 * 60 * 60  # seconds
+places_search_cache = PersistentCache("places_search", default_ttl=PLACES_SEARCH_TTL)
+
+TILE_PAD_M = 400  # searches run from the tile centre, so pad the radius to cover the whole tile
+RADIUS_STEP_M = 250  # search radii are rounded up to a multiple of this, so nearby ranges share cache entries
+# Larger areas are covered by a hexagonal lattice of overlapping circles of this radius.
+MAX_CIRCLE_RADIUS_M = 1500
+# A nearby search returns at most three pages of 20. A circle that fills all of them
+# probably holds more pubs, so it is searched again as four smaller circles.
+PAGE_SIZE = 20
+MAX_PAGES = 3
+MAX_SEARCH_SPLITS = 2
+MIN_CIRCLE_RADIUS_M = 300
+SPLIT_RADIUS_FACTOR = 0.71  # four circles at (+-r/2, +-r/2) cover the parent when their radius is r/sqrt(2)
+
+# A next_page_token only becomes valid a short while after it is issued.
+NEXT_PAGE_DELAY_S = 2.0
+NEXT_PAGE_RETRIES = 3
+
+SEARCH_WORKERS = 4  # circles searched at once
+
+
+def offset_point(latitude: float, longitude: float, north_m: float, east_m: float) -> tuple[float, float]:
+    """
+    Return the point north_m metres north and east_m metres east of (latitude, longitude).
+    """
+    lat_m, lon_m = metres_per_degree(latitude)
+    return round(latitude + north_m / lat_m, 6), round(longitude + east_m / lon_m, 6)
+
+
+def plan_search_circles(latitude: float, longitude: float, radius_km: float) -> list[tuple[float, float, int]]:
+    """
+    Return the (latitude, longitude, radius_m) circles to search so that every point
+    within radius_km of the given coordinate is covered.
+
+    A range up to MAX_CIRCLE_RADIUS_M is one circle sized to it. Anything larger is
+    tiled with a hexagonal lattice of MAX_CIRCLE_RADIUS_M circles. Both are anchored
+    on the centre of the origin's cache tile, so searches started anywhere in the
+    same tile ask for exactly the same circles.
+    """
+    centre_lat, centre_lon = tile_centre(latitude, longitude)
+    radius_m = math.ceil((radius_km * 1000 + TILE_PAD_M) / RADIUS_STEP_M) * RADIUS_STEP_M
+    if radius_m <= MAX_CIRCLE_RADIUS_M:
+        return [(round(centre_lat, 6), round(centre_lon, 6), radius_m)]
+
+    # Centres sqrt(3) * r apart along rows 1.5 * r apart, alternate rows shifted by half a step.
+    step_m = math.sqrt(3) * MAX_CIRCLE_RADIUS_M
+    row_m = 1.5 * MAX_CIRCLE_RADIUS_M
+    rows = math.ceil((radius_m + MAX_CIRCLE_RADIUS_M) / row_m)
+    columns = math.ceil((radius_m + MAX_CIRCLE_RADIUS_M) / step_m) + 1
+    circles = []
+    for row in range(-rows, rows + 1):
+        north_m = row * row_m
+        shift_m = step_m / 2 if row % 2 else 0.0
+        for column in range(-columns, columns + 1):
+            east_m = column * step_m + shift_m
+            # Keep every circle that reaches into the search area.
+            if math.hypot(north_m, east_m) - MAX_CIRCLE_RADIUS_M < radius_m:
+                circles.append((*offset_point(centre_lat, centre_lon, north_m, east_m), MAX_CIRCLE_RADIUS_M))
+    return circles
+
+
+def split_circle(circle: tuple[float, float, int]) -> list[tuple[float, float, int]]:
+    """
+    Cover a circle with four smaller overlapping circles.
+    """
+    latitude, longitude, radius_m = circle
+    offset_m = radius_m / 2
+    sub_radius_m = math.ceil(radius_m * SPLIT_RADIUS_FACTOR)
+    return [(*offset_point(latitude, longitude, north, east), sub_radius_m)
+            for north in (offset_m, -offset_m) for east in (-offset_m, offset_m)]
+
+
+def _request_page(gmaps: googlemaps.Client, circle: tuple[float, float, int], page_token: str = None) -> dict:
+    latitude, longitude, radius_m = circle
+    if page_token is None:
+        return call_with_backoff(
+            "places_search", gmaps.places_nearby,
+            location=(latitude, longitude),
+            radius=radius_m,
+            type="bar",  # use 'bar' as the type to capture pubs
+            keyword="pub"
+        )
+
+    for attempt in range(NEXT_PAGE_RETRIES + 1):
+        time.sleep(NEXT_PAGE_DELAY_S)
+        try:
+            return call_with_backoff("places_search", gmaps.places_nearby, page_token=page_token)
+        except googlemaps.exceptions.ApiError as e:
+            # INVALID_REQUEST here means the token is not live yet.
+            if e.status != "INVALID_REQUEST" or attempt == NEXT_PAGE_RETRIES:
+                raise
+
+
+def circle_key(circle: tuple[float, float, int]) -> str:
+    latitude, longitude, radius_m = circle
+    return f"{latitude:.6f},{longitude:.6f}:{radius_m}:bar:pub"
+
+
+def search_circle(gmaps: googlemaps.Client, circle: tuple[float, float, int],
+                  on_page=None) -> tuple[list[dict], bool, int]:
+    """
+    Run the nearby pub search for one circle, following next_page_token through every
+    page. on_page (if given) is called with each page's results as soon as it arrives.
+
+    Returns (places, saturated, requests), where saturated means every page came back
+    full and requests is how many pages were fetched from the API (0 if cached).
+    The pages of a circle are cached together, as page tokens expire with the search.
+    """
+    key = circle_key(circle)
+    cached = places_search_cache.get(key)
+    if cached is not None:
+        for page in cached["pages"]:
+            if on_page:
+                on_page(page)
+        return [place for page in cached["pages"] for place in page], cached["saturated"], 0
+
+    pages = []
+    page_token = None
+    for _ in range(MAX_PAGES):
+        response = _request_page(gmaps, circle, page_token)
+        page = response.get("results", [])
+        pages.append(page)
+        if on_page:
+            on_page(page)
+        page_token = response.get("next_page_token")
+        if not page_token:
+            break
+
+    places = [place for page in pages for place in page]
+    saturated = len(places) >= PAGE_SIZE * MAX_PAGES
+    places_search_cache.set(key, {"pages": pages, "saturated": saturated})
+    return places, saturated, len(pages)
+
+
+def search_places(gmaps: googlemaps.Client, latitude: float, longitude: float, radius_km: float,
+                  on_page=None, max_workers: int = SEARCH_WORKERS, budget: CallBudget = None) -> list[dict]:
+    """
+    Find every pub within radius_km of the given coordinate (plus some margin; callers
+    still filter by exact distance).
+
+    The circles from plan_search_circles are searched concurrently, and any circle
+    that comes back saturated is split up and searched again. Results are
+    deduplicated by place_id and ordered by circle, page and rank, so they do not
+    depend on which requests happen to finish first.
+
+    on_page (if given) is called with each page's previously unseen places, in that
+    same order: pages of the earliest circle still outstanding are passed on as soon
+    as they arrive, and pages of later circles are held back until it is done.
+
+    With a budget, each uncached circle reserves MAX_PAGES searches before it is
+    sent (unused ones are given back once it is done). Circles nearest the origin
+    reserve first, and a saturated circle is only split once every circle before it
+    has finished, so which circles are dropped never depends on timing.
+    """
+    circles = plan_search_circles(latitude, longitude, radius_km)
+    seen = set()
+    lock = threading.Lock()
+    held = {}  # order -> pages waiting for every earlier circle to finish
+    open_orders = set()  # circles submitted but not yet finished and reported
+    head = [None]  # the earliest open circle, whose pages are reported straight away
+
+    def report_new(page):
+        new = [place for place in page if place.get("place_id") not in seen]
+        seen.update(place.get("place_id") for place in new)
+        if new and on_page:
+            on_page(new)
+
+    def reporter(order):
+        def report(page):
+            with lock:
+                if order == head[0]:
+                    report_new(page)
+                else:
+                    held.setdefault(order, []).append(page)
+        return report
+
+    def reserve(circle):
+        """Searches reserved for the circle, or None if it is over budget."""
+        if budget is None or circle_key(circle) in places_search_cache:
+            return 0
+        if budget.take("places_search", MAX_PAGES):
+            return MAX_PAGES
+        budget.degrade("places_search")
+        return None
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        finished = {}
+
+        def submit(circle, order, depth, reserved):
+            future = executor.submit(search_circle, gmaps, circle, reporter(order))
+            pending[future] = (circle, order, depth, reserved)
+            open_orders.add(order)
+
+        lat_m, lon_m = metres_per_degree(latitude)
+        nearest_first = sorted(range(len(circles)), key=lambda i: math.hypot(
+            (circles[i][0] - latitude) * lat_m, (circles[i][1] - longitude) * lon_m))
+        reserved = {i: reserve(circles[i]) for i in nearest_first}
+        with lock:
+            for i, circle in enumerate(circles):
+                if reserved[i] is not None:
+                    submit(circle, (i,), 0, reserved[i])
+            head[0] = min(open_orders, default=None)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                circle, order, depth, reserved = pending.pop(future)
+                places, saturated, requests = future.result()
+                results[order] = places
+                finished[order] = (circle, depth, saturated, reserved - requests)
+
+            # Finish circles in order, so splits and budget decisions happen in order too.
+            with lock:
+                while head[0] in finished:
+                    order = head[0]
+                    circle, depth, saturated, unused = finished.pop(order)
+                    if budget is not None and unused > 0:
+                        budget.give_back("places_search", unused)
+                    if saturated and depth < MAX_SEARCH_SPLITS and circle[2] > MIN_CIRCLE_RADIUS_M:
+                        for j, sub_circle in enumerate(split_circle(circle)):
+                            sub_reserved = reserve(sub_circle)
+                            if sub_reserved is not None:
+                                submit(sub_circle, order + (j,), depth + 1, sub_reserved)
+                    open_orders.discard(order)
+                    head[0] = min(open_orders, default=None)
+                    for page in held.pop(head[0], []):
+                        report_new(page)
+
+    unique = {}
+    for order in sorted(results):
+        for place in results[order]:
+            unique.setdefault(place.get("place_id"), place)
+    return list(unique.values())
@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import os
+import threading
+from dataclasses import dataclass, replace
+import googlemaps
+from api_key import API_KEY
+from budget import CallBudget, DEGRADATIONS
+from ratelimit import new_client
+from route import Route, Pub, Crawl
+from graph import CompactGraph
+from location import Location
+from edge_costs import DistanceMatrixCostProvider
+from get_pubs import (adjust_pub_ratings_for_crime, get_unique_crimes_for_pubs, SCORING_FIELDS, DETAIL_FIELDS,
+                      SENTIMENT_FIELDS)
+from get_routes import (create_graph_from_routes, add_shortest_edges_to_connect_graph,
+                        select_best_and_worst_routes)
+from pipeline import gather_area, finish_crawl
+from metrics import span
+from snapshot import AreaSnapshot
+import search
+
+# How much each minute of walking counts against a route, by the request's "walking" preference.
+WALKING_EDGE_WEIGHTS = {0: 5, 1: 2, 2: 0.3}
+DEFAULT_EDGE_WEIGHT = 1
+
+# Route search: "exact" (branch and bound), "stream" (lazy enumeration into bounded heaps),
+# both in search.py, or "legacy" (materialise every route).
+SEARCH_METHOD = "exact"
+# Processes used by the route search (1 searches in-process). Worth raising for the "stream"
+# method on dense graphs; the exact search is usually done before a pool could start.
+SEARCH_WORKERS = int(os.environ.get("SEARCH_WORKERS", 1))
+CRIME_RADIUS_KM = 0.3  # crimes within this distance of a pub count against it
+CRIME_DATE = "2024-01"  # month of police data the crimes are counted from, unless a request picks one
+
+# "tiered": fetch only the scoring fields of every pub and the rest for pubs on the chosen crawl.
+# "full": fetch every detail field for every pub up front.
+DETAILS_MODE = "tiered"
+
+# Stars added to a pub's rating per unit of mean review sentiment (-1..+1), for requests that
+# do not set "sentiment_weight"; taken from the SENTIMENT_WEIGHT environment variable. 0 leaves
+# sentiment out of the ranking, so the reviews and nltk are never loaded.
+SENTIMENT_WEIGHT = float(os.environ.get("SENTIMENT_WEIGHT", 0))
+SENTIMENT_WORKERS = 1  # processes used to score reviews
+
+_client = None
+_client_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def default_client() -> googlemaps.Client:
+    """
+    Return the Google Maps client shared by planners that are not given one,
+    creating it on first use.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = new_client(API_KEY)
+        return _client
+
+
+def set_default_client(client):
+    """
+    Replace the shared client, e.g. with a transport.GoogleMapsTransport for
+    recording or replaying API responses.
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+
+@dataclass(frozen=True)
+class PlannerConfig:
+    """
+    Everything one crawl request may change about how it is planned.
+    """
+    radius_km: float = 1
+    warrior_mode: bool = False
+    visit_bad_pubs: bool = False
+    walking_preference: int = 2
+    search_method: str = SEARCH_METHOD
+    search_workers: int = SEARCH_WORKERS
+    details_mode: str = DETAILS_MODE
+    crime_radius_km: float = CRIME_RADIUS_KM
+    sentiment_weight: float = SENTIMENT_WEIGHT
+    crime_date: str = CRIME_DATE
+    frontier: bool = False  # also find the Pareto frontiers of crawls, see Planner.frontier
+
+    @classmethod
+    def from_attr(cls, attr: dict) -> "PlannerConfig":
+        """
+        Build the configuration from a request's JSON attributes.
+        """
+        if attr["maximise_rating"] == 1: visit_bad_pubs = False
+        elif attr["maximise_rating"] == 0: visit_bad_pubs = True
+        else:
+            logger.warning("maximise_rating %r not understood, VISIT_BAD_PUBS defaulted to False",
+                           attr["maximise_rating"])
+            visit_bad_pubs = False
+        return cls(
+            radius_km=attr["range"],
+            warrior_mode=attr["warrior_mode"],
+            visit_bad_pubs=visit_bad_pubs,
+            walking_preference=attr["walking"],
+            sentiment_weight=float(attr.get("sentiment_weight", SENTIMENT_WEIGHT)),
+            crime_date=attr.get("crime_date", CRIME_DATE),
+            frontier=bool(attr.get("frontier", False))
+        )
+
+    @property
+    def edge_weight(self) -> float:
+        return WALKING_EDGE_WEIGHTS.get(self.walking_preference, DEFAULT_EDGE_WEIGHT)
+
+    @property
+    def prefers_bad_pubs(self) -> bool:
+        """Whether low ratings are the goal (bad pub or warrior mode)."""
+        return self.visit_bad_pubs or self.warrior_mode
+
+
+class Planner:
+    """
+    Plans one crawl. All the settings and clients a request needs live on the planner,
+    so any number of planners can run at once in different threads or processes.
+    The planner's budget caps the upstream calls of its crawl; degraded lists the
+    stages that fell back to cheaper answers.
+
+    plan() leaves what it fetched about the area in snapshot (see snapshot.py), and
+    replan() plans from such a snapshot with this planner's config: only scoring,
+    the route search and the chosen crawl's legs and extras run again.
+
+    With config.frontier set, plan() also fills in frontier: the Pareto-optimal
+    crawls over (rating, crime, time), by direction in search.FRONTIER_SENSES. A
+    pub's rating there is its rating before crime is subtracted, and as in the route
+    search, a pub counts towards a crawl's rating and crime when a leg leaves it.
+    The crawl plan() returns is the one maximising rating - crime - edge_weight * time
+    on the "peacekeeper" frontier (the bad pub and warrior options negate the ratings
+    twice, so they only change the ratings shown), and any other weighting can be
+    picked from the frontiers without planning again.
+    """
+
+    def __init__(self, config: PlannerConfig, gmaps: googlemaps.Client = None, budget: CallBudget = None):
+        self.config = config
+        self.gmaps = gmaps or default_client()
+        self.budget = budget or CallBudget()
+        self.provider = DistanceMatrixCostProvider(self.gmaps, budget=self.budget)
+        self.snapshot = None
+        self.frontier = None
+        self._weights = ()
+
+    @property
+    def degraded(self) -> list[str]:
+        """The degraded stages, in DEGRADATIONS order: this crawl's and its snapshot's."""
+        stages = set(self.budget.degraded)
+        if self.snapshot is not None:
+            stages.update(self.snapshot.degraded)
+        return [stage for stage in DEGRADATIONS if stage in stages]
+
+    def vertex_weight(self, current: Location) -> float:
+        """The pub's route weight, the same for good and bad pubs (see AreaSnapshot.vertex_weights)."""
+        return self._weights[self.snapshot.graph.index[current]]
+
+    def crime_count(self, current: Location) -> int:
+        return self.snapshot.crime_counts[self.snapshot.graph.index[current]]
+
+    def pub_rating(self, current: Location) -> float:
+        """The pub's rating before its crimes were subtracted (and before any bad-pub negation)."""
+        return self.vertex_weight(current) + self.crime_count(current)
+
+    def shown_rating(self, current: Location) -> float:
+        """The rating sent to the client, negated if bad pubs are the goal."""
+        return -self.vertex_weight(current) if self.config.prefers_bad_pubs else self.vertex_weight(current)
+
+    def find_frontier(self, photos: dict) -> dict[str, list[Crawl]]:
+        frontiers = search.pareto_routes(self.snapshot.graph, self.pub_rating, self.crime_count)
+        return {
+            name: [Crawl(pubs=[self.to_pub(stop, photos) for stop in path], rating=rating, crime=int(crime),
+                         time=int(time))
+                   for path, rating, crime, time in crawls]
+            for name, crawls in frontiers.items()
+        }
+
+    def to_pub(self, stop: Location, photos: dict) -> Pub:
+        """
+        Convert a graph vertex to the route.Pub sent to the client. 'photos' holds the
+        photo references of pubs whose extras this crawl fetched.
+        """
+        return Pub(
+            name=stop.name,
+            loc=(stop.latitude, stop.longitude),
+            rating=self.shown_rating(stop),
+            photo_reference=photos.get(stop, stop.attr.get("photo_reference", ""))
+        )
+
+    def plan(self, latitude: float, longitude: float, show: bool = False) -> list[Route]:
+        """
+        Fetch pubs, build the route graph, select the best route, and then for each
+        consecutive pair of pubs in the best route, call the directions API to
+        retrieve (and decode) the polyline. For each segment a Route object is created.
+        The network stages run through the asyncio pipeline in pipeline.py; scoring
+        and the route search are synchronous.
+        Returns the list of Route objects for the best route.
+        """
+        config = self.config
+        logger.info("Planning crawl at %s, %s: warrior_mode=%s visit_bad_pubs=%s walking=%s edge_weight=%s",
+                    latitude, longitude, config.warrior_mode, config.visit_bad_pubs,
+                    config.walking_preference, config.edge_weight)
+
+        # Fetch pubs, then their details, nearby crimes and walking times concurrently.
+        detail_fields = SCORING_FIELDS if config.details_mode == "tiered" else DETAIL_FIELDS
+        if config.sentiment_weight and config.details_mode == "tiered":
+            detail_fields = SCORING_FIELDS + SENTIMENT_FIELDS
+        with span("gather_area"):
+            pubs, unique_crimes, routes = asyncio.run(gather_area(
+                self.gmaps, latitude, longitude, config.radius_km, self.provider,
+                crime_radius_km=config.crime_radius_km, date=config.crime_date, fields=detail_fields,
+                budget=self.budget))
+        logger.info("Found %d pubs and %d unique crimes", len(pubs), len(unique_crimes))
+
+        with span("scoring"):
+            if config.sentiment_weight:
+                # Imported here: nltk is slow to load and only needed when sentiment is on.
+                from nlp import get_engine
+                get_engine().score_pubs(pubs, SENTIMENT_WORKERS)
+            # The pubs as fetched, for the snapshot; scoring rewrites their ratings.
+            fetched = {pub.name: replace(pub) for pub in pubs}
+            if config.sentiment_weight:
+                for pub in pubs:
+                    pub.rating += config.sentiment_weight * pub.sentiment
+
+            if config.warrior_mode: crime_penalty = -10
+            else: crime_penalty = 3
+            adjust_pub_ratings_for_crime(pubs, unique_crimes, threshold_km=config.crime_radius_km,
+                                         penalty_per_crime=crime_penalty)
+
+            for pub in pubs:
+                if config.prefers_bad_pubs:
+                    pub.rating = -pub.rating
+                logger.debug("%s is rated %s", pub.name, pub.rating)
+
+        with span("build_graph"):
+            graph, pub_map = create_graph_from_routes(routes, pubs)
+            graph = add_shortest_edges_to_connect_graph(graph, pubs, pub_map, self.provider)
+            compact = CompactGraph.from_graph(graph)
+
+        # Vertices are named after their pubs (the last pub of a name wins, as in pub_map).
+        pubs_by_name = {pub.name: pub for pub in pubs}
+        self.snapshot = AreaSnapshot(
+            latitude, longitude, config.radius_km,
+            pubs=tuple(fetched[vertex.name] for vertex in compact.vertices),
+            graph=compact,
+            crime_date=config.crime_date,
+            crime_radius_km=config.crime_radius_km,
+            crime_counts=tuple(pubs_by_name[vertex.name].nearby_crimes for vertex in compact.vertices),
+            degraded=tuple(self.budget.degraded),
+            sentiment_scored=bool(config.sentiment_weight)
+        )
+        best_route_segments = self._plan_snapshot(graph)
+
+        # Optionally, visualize the graph.
+        if show:
+            # Imported here so serving never loads matplotlib and networkx.
+            from visualise import visualize_graph
+            visualize_graph(graph)
+
+        return best_route_segments
+
+    def replan(self, snapshot: AreaSnapshot) -> list[Route]:
+        """
+        Plan the crawl again from an area snapshot, with this planner's config and
+        without searching for pubs or costing walks again. If the config counts crimes
+        from another month (or within another radius) than the snapshot, those crimes
+        are fetched and only the pubs whose counts change are rescored; the new
+        snapshot is left in self.snapshot. Review sentiment only counts if the snapshot
+        was planned with a sentiment weight, as the reviews are not fetched otherwise.
+        Returns the list of Route objects for the best route, as plan() does.
+        """
+        config = self.config
+        if config.sentiment_weight and not snapshot.sentiment_scored:
+            logger.warning("Snapshot %s was planned without review sentiment; sentiment_weight %s has no effect",
+                           snapshot.snapshot_id, config.sentiment_weight)
+        if (config.crime_date, config.crime_radius_km) != (snapshot.crime_date, snapshot.crime_radius_km):
+            with span("crimes"):
+                crimes = get_unique_crimes_for_pubs(list(snapshot.pubs), config.crime_date, config.crime_radius_km,
+                                                    self.budget)
+            snapshot = snapshot.with_crimes(crimes, config.crime_date, config.crime_radius_km,
+                                            degraded="crimes" in self.budget.degraded)
+        self.snapshot = snapshot
+        return self._plan_snapshot()
+
+    def _plan_snapshot(self, graph=None) -> list[Route]:
+        """
+        Score self.snapshot's pubs, search its graph, and fetch the legs and extras of
+        the best crawl (and the frontiers, if asked for). 'graph' is the UndirectedGraph
+        the snapshot's graph was built from, which only the legacy search needs.
+        """
+        config = self.config
+        self._weights = self.snapshot.vertex_weights(config.sentiment_weight)
+        compact = self.snapshot.graph.with_vertex_weights(self._weights)
+
+        # Select best (and worst) route by weight
+        with span("route_search"):
+            if config.search_method == "legacy" and graph is not None:
+                best_node, best_node_w, worst_node, worst_node_w = select_best_and_worst_routes(
+                    graph, self.vertex_weight, config.edge_weight)
+            else:
+                # Snapshots keep no UndirectedGraph; the exact search finds the legacy search's crawl.
+                method = "exact" if config.search_method == "legacy" else config.search_method
+                best_node, best_node_w, worst_node, worst_node_w = search.best_and_worst_routes(
+                    compact, None, config.edge_weight, method, config.search_workers)
+
+        # Now build the list of Route objects for the best route.
+        best_route_segments = []
+        photos = {}
+        if best_node and len(best_node) >= 2:
+            # Legs and the extra details (e.g. photos) are only fetched for the pubs on the crawl,
+            # into copies: the snapshot's pubs are shared with other plans.
+            stop_pubs = [replace(self.snapshot.pubs[compact.index[stop]]) for stop in best_node]
+            with span("finish_crawl"):
+                segment_infos = asyncio.run(finish_crawl(self.gmaps, best_node, stop_pubs, self.budget, compact))
+            photos = {stop: pub.photo_reference for stop, pub in zip(best_node, stop_pubs)}
+            for i, segment_info in enumerate(segment_infos):
+                if segment_info is not None:
+                    distance, time_minutes, points = segment_info
+                    best_route_segments.append(Route(
+                        start_node=self.to_pub(best_node[i], photos),
+                        end_node=self.to_pub(best_node[i + 1], photos),
+                        time=time_minutes,
+                        distance=distance,
+                        route=points
+                    ))
+
+        # After finish_crawl, so the served crawl's pubs carry their photos here too.
+        if config.frontier:
+            with span("frontier"):
+                self.frontier = self.find_frontier(photos)
+
+        return best_route_segments
@@ -1,6 +1,4 @@
 import requests
-import folium
-from folium.plugins import MarkerCluster
 
 def get_pub_prices_by_point(lat, lng, radius=500):
     """
@@ -38,6 +36,10 @@ def plot_pub_prices(pubs, lat, lng):
         lat (float): Latitude of the central point.
         lng (float): Longitude of the central point.
     """
+    # Imported here: folium is only needed for plotting and is slow to import.
+    import folium
+    from folium.plugins import MarkerCluster
+
     pub_map = folium.Map(location=[lat, lng], zoom_start=14, control_scale=True)
     marker_cluster = MarkerCluster().add_to(pub_map)
 
@@ -0,0 +1,87 @@
+import random
+import threading
+import time
+import googlemaps
+from metrics import UPSTREAM_CALLS
+
+# Sustained requests per second allowed against each upstream, and how many may burst at once.
+RATE_LIMITS = {
+    "places_search": (10.0, 10),
+    "places_details": (10.0, 10),
+    "directions": (10.0, 10),
+    "distance_matrix": (5.0, 5),
+}
+
+# Set to False to skip the token buckets, e.g. when replaying recorded responses.
+ENABLED = True
+
+MAX_RETRIES = 4
+BACKOFF_BASE_S = 0.5
+# Left to itself, googlemaps.Client retries OVER_QUERY_LIMIT for up to a minute and then
+# raises Timeout, so call_with_backoff never sees it. Clients from new_client() raise it
+# straight away and give up on other retriable errors (5xx) after this many seconds.
+CLIENT_RETRY_TIMEOUT_S = 10
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket: refills at 'rate' tokens per second up to 'capacity'.
+    acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_buckets = {upstream: TokenBucket(rate, capacity) for upstream, (rate, capacity) in RATE_LIMITS.items()}
+
+
+def bucket_for(upstream: str) -> TokenBucket:
+    """Return the shared token bucket for an upstream named in RATE_LIMITS."""
+    return _buckets[upstream]
+
+
+def new_client(api_key: str) -> googlemaps.Client:
+    """A Google Maps client that leaves OVER_QUERY_LIMIT retries to call_with_backoff."""
+    return googlemaps.Client(key=api_key, retry_over_query_limit=False, retry_timeout=CLIENT_RETRY_TIMEOUT_S)
+
+
+def call_with_backoff(upstream: str, func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs) once the upstream's token bucket allows it, retrying
+    with jittered exponential backoff while Google answers OVER_QUERY_LIMIT.
+    """
+    bucket = bucket_for(upstream)
+    for attempt in range(MAX_RETRIES + 1):
+        if ENABLED:
+            bucket.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except googlemaps.exceptions.ApiError as e:
+            if e.status != "OVER_QUERY_LIMIT" or attempt == MAX_RETRIES:
+                UPSTREAM_CALLS.inc(upstream=upstream, outcome="error")
+                raise
+            UPSTREAM_CALLS.inc(upstream=upstream, outcome="retry")
+        except Exception:
+            UPSTREAM_CALLS.inc(upstream=upstream, outcome="error")
+            raise
+        else:
+            UPSTREAM_CALLS.inc(upstream=upstream, outcome="ok")
+            return result
+        time.sleep(BACKOFF_BASE_S * 2 ** attempt * (1 + random.random()))
@@ -14,3 +14,14 @@ class Route:
     time: int
     distance: int 
     route: list[tuple[float, float]]
+
+@dataclass
+class Crawl:
+    """
+    One crawl on a Pareto frontier: its stops in order and its totals. Legs are
+    not fetched, so there is no polyline.
+    """
+    pubs: list[Pub]
+    rating: float
+    crime: int
+    time: int
@@ -0,0 +1,393 @@
+import bisect
+import heapq
+import math
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from graph import CompactGraph
+from metrics import ROUTES_ENUMERATED
+
+# A crawl visits between MIN_CRAWL_PUBS and MAX_CRAWL_PUBS pubs (inclusive).
+MIN_CRAWL_PUBS = 3
+MAX_CRAWL_PUBS = 5
+
+# Maximum allowed turning angle between consecutive legs (in radians).
+ANGLE_THRESHOLD = math.radians(150)
+COS_ANGLE_THRESHOLD = math.cos(ANGLE_THRESHOLD)
+
+# Slack for floating point error when comparing bounds against the incumbent.
+BOUND_EPSILON = 1e-9
+
+# Graphs smaller than this are searched in-process; a process pool costs more than it saves.
+PARALLEL_MIN_VERTICES = 40
+# Start vertices are dealt round-robin into this many chunks per worker, to balance uneven subtrees.
+CHUNKS_PER_WORKER = 4
+
+# The directions Pareto frontiers are taken in: whether higher totals of rating and of
+# crime are better. Shorter walks are always better.
+FRONTIER_SENSES = {"peacekeeper": (1, -1), "warrior": (-1, 1)}
+
+
+def _index_graph(graph, vertex_weight, edge_weight):
+    """
+    Prepare a graph (UndirectedGraph or CompactGraph) for the search.
+
+    Returns the vertices and a plain tuple (offsets, neighbours, costs, weights, turns):
+    the CSR arrays of a CompactGraph with edge costs pre-scaled by edge_weight,
+    each vertex's route weight, and the turn table for ANGLE_THRESHOLD (see
+    CompactGraph.turn_table). The tuple holds no vertex objects, so it is cheap to
+    send to worker processes.
+
+    Route weights come from calling vertex_weight on each vertex or, if it is None,
+    from the graph's own vertex weights (see CompactGraph.with_vertex_weights).
+    """
+    compact = graph if isinstance(graph, CompactGraph) else CompactGraph.from_graph(graph)
+    costs = [weight * edge_weight for weight in compact.edge_weights]
+    if vertex_weight is None:
+        weights = compact.vertex_weights
+    else:
+        weights = [vertex_weight(vertex) for vertex in compact.vertices]
+    turns = compact.turn_table(COS_ANGLE_THRESHOLD)
+    return compact.vertices, (compact.offsets, compact.neighbours, costs, weights, turns)
+
+
+def _branch_and_bound(search_graph, sign, starts):
+    """
+    Find the first route (in the legacy DFS order) maximising sign * weight,
+    among routes starting at one of 'starts' (visited in ascending order).
+
+    A route's weight is the sum, over each leg, of the weight of the pub the leg
+    leaves from minus the leg's cost, exactly as the legacy DFS scores it.
+    Subtrees whose optimistic bound cannot beat the best route found so far are
+    skipped, so dominated paths are never enumerated.
+
+    Returns (path, weight, number of complete routes scored).
+    """
+    offsets, neighbours, costs, weights, turns = search_graph
+    # Best possible gain of one leg leaving each vertex, and of any leg at all.
+    step_gain = [
+        max((sign * (weights[i] - costs[slot]) for slot in range(offsets[i], offsets[i + 1])), default=-math.inf)
+        for i in range(len(weights))
+    ]
+    best_gain = max(step_gain, default=-math.inf)
+
+    best = [-math.inf, None]
+    scored = [0]
+    path = []
+    on_path = [False] * len(weights)
+
+    def bound(current, length, current_weight):
+        # Optimistic value of extending the route by 1..(MAX - length) legs.
+        min_legs = max(1, MIN_CRAWL_PUBS - length)
+        max_legs = MAX_CRAWL_PUBS - length
+        legs = max_legs if best_gain > 0 else min_legs
+        return current_weight + step_gain[current] + (legs - 1) * best_gain
+
+    def dfs(current, current_weight, via):
+        length = len(path)
+        if length >= MIN_CRAWL_PUBS:
+            scored[0] += 1
+            if current_weight > best[0]:
+                best[0] = current_weight
+                best[1] = list(path)
+        if length == MAX_CRAWL_PUBS:
+            return
+        if bound(current, length, current_weight) + BOUND_EPSILON <= best[0]:
+            return
+
+        # After the first leg, only legs the turn table allows may follow the one we arrived by.
+        for slot in turns[via] if via is not None else range(offsets[current], offsets[current + 1]):
+            neighbor = neighbours[slot]
+            if on_path[neighbor]:
+                continue
+            path.append(neighbor)
+            on_path[neighbor] = True
+            # Terms are added in the legacy DFS's order, so float rounding (and so ties) match it exactly.
+            dfs(neighbor, current_weight - sign * costs[slot] + sign * weights[current], slot)
+            on_path[neighbor] = False
+            path.pop()
+
+    for start in starts:
+        path.append(start)
+        on_path[start] = True
+        dfs(start, 0.0, None)
+        on_path[start] = False
+        path.pop()
+
+    return best[1], sign * best[0] if best[1] is not None else None, scored[0]
+
+
+def _iter_routes(search_graph, starts):
+    """
+    Lazily yield (path, weight) for every route, with paths as tuples of vertex indices.
+
+    Each simple path is walked once, from whichever end has the lower index, and
+    yielded in both directions: the turning-angle rule is symmetric and the
+    reversed route's weight follows in O(1) from the forward one. Starts are
+    limited to 'starts' so the work can be split between workers.
+    """
+    offsets, neighbours, costs, weights, turns = search_graph
+    path = []
+    on_path = [False] * len(weights)
+
+    def extend(current, current_weight, via):
+        length = len(path)
+        if length >= MIN_CRAWL_PUBS and current > path[0]:
+            yield tuple(path), current_weight
+            yield tuple(reversed(path)), current_weight - weights[path[0]] + weights[current]
+        if length == MAX_CRAWL_PUBS:
+            return
+
+        for slot in turns[via] if via is not None else range(offsets[current], offsets[current + 1]):
+            neighbor = neighbours[slot]
+            if on_path[neighbor]:
+                continue
+            # A final leg back below the start index is the reverse of a route found from that end.
+            if length == MAX_CRAWL_PUBS - 1 and neighbor < path[0]:
+                continue
+            path.append(neighbor)
+            on_path[neighbor] = True
+            yield from extend(neighbor, current_weight - costs[slot] + weights[current], slot)
+            on_path[neighbor] = False
+            path.pop()
+
+    for start in starts:
+        path.append(start)
+        on_path[start] = True
+        yield from extend(start, 0.0, None)
+        on_path[start] = False
+        path.pop()
+
+
+def iter_routes(graph, vertex_weight, edge_weight: float):
+    """
+    Generator over every crawl in the graph as (list of vertices, weight), without
+    materialising the full list. Every route get_all_routes finds is yielded once.
+    """
+    vertices, search_graph = _index_graph(graph, vertex_weight, edge_weight)
+    for path, weight in _iter_routes(search_graph, range(len(vertices))):
+        yield [vertices[i] for i in path], weight
+
+
+def _top_and_bottom(routes, k):
+    """
+    Keep the k highest and k lowest weighted routes from a stream of (path, weight).
+    Among equal weights the route seen first wins. Both lists come back best-first
+    (highest weight first for the top, lowest first for the bottom), followed by
+    how many routes were seen.
+    """
+    top, bottom = [], []
+    seen = 0
+    for seq, (path, weight) in enumerate(routes):
+        seen += 1
+        # Min-heap of the k best: the root is the first to be evicted.
+        entry = (weight, -seq, path)
+        if len(top) < k:
+            heapq.heappush(top, entry)
+        elif entry > top[0]:
+            heapq.heapreplace(top, entry)
+        entry = (-weight, -seq, path)
+        if len(bottom) < k:
+            heapq.heappush(bottom, entry)
+        elif entry > bottom[0]:
+            heapq.heapreplace(bottom, entry)
+    top = [(path, weight) for weight, _, path in sorted(top, reverse=True)]
+    bottom = [(path, -weight) for weight, _, path in sorted(bottom, reverse=True)]
+    return top, bottom, seen
+
+
+def top_and_bottom_routes(graph, vertex_weight, edge_weight: float, k: int = 1) -> tuple[list, list]:
+    """
+    Stream every route through bounded heaps, returning the k best and k worst
+    routes as lists of (list of vertices, weight). Memory stays at O(k) routes
+    however many routes the graph has.
+    """
+    vertices, search_graph = _index_graph(graph, vertex_weight, edge_weight)
+    top, bottom, seen = _top_and_bottom(_iter_routes(search_graph, range(len(vertices))), k)
+    ROUTES_ENUMERATED.inc(seen, method="stream")
+    return ([([vertices[i] for i in path], weight) for path, weight in top],
+            [([vertices[i] for i in path], weight) for path, weight in bottom])
+
+
+def _extremes(search_graph, starts, method):
+    """
+    Best and worst route among those starting at 'starts', as
+    (best_path, best_weight, worst_path, worst_weight, routes scored) with index paths.
+    """
+    if method == "stream":
+        top, bottom, seen = _top_and_bottom(_iter_routes(search_graph, starts), 1)
+        if not top:
+            return None, None, None, None, seen
+        return top[0][0], top[0][1], bottom[0][0], bottom[0][1], seen
+
+    best_path, best_weight, best_scored = _branch_and_bound(search_graph, 1, starts)
+    worst_path, worst_weight, worst_scored = _branch_and_bound(search_graph, -1, starts)
+    return best_path, best_weight, worst_path, worst_weight, best_scored + worst_scored
+
+
+# Each worker process gets one copy of the indexed graph, sent once when the pool starts.
+_worker_graph = None
+
+
+def _init_worker(search_graph):
+    global _worker_graph
+    _worker_graph = search_graph
+
+
+def _search_starts(starts, method):
+    return _extremes(_worker_graph, starts, method)
+
+
+def _merge_extremes(results):
+    """
+    Combine per-chunk extremes. Ties go to the route with the lower start index,
+    which is the one a single serial search would have found first.
+    """
+    best_path, best_weight, worst_path, worst_weight, scored = None, None, None, None, 0
+    for chunk_best, chunk_best_weight, chunk_worst, chunk_worst_weight, chunk_scored in results:
+        scored += chunk_scored
+        if chunk_best is None:
+            continue
+        if best_path is None or (chunk_best_weight, -chunk_best[0]) > (best_weight, -best_path[0]):
+            best_path, best_weight = chunk_best, chunk_best_weight
+        if worst_path is None or (chunk_worst_weight, chunk_worst[0]) < (worst_weight, worst_path[0]):
+            worst_path, worst_weight = chunk_worst, chunk_worst_weight
+    return best_path, best_weight, worst_path, worst_weight, scored
+
+
+def best_and_worst_routes(graph, vertex_weight, edge_weight: float, method: str = "exact",
+                          workers: int = 1) -> tuple:
+    """
+    Exact replacement for enumerating every route with get_all_routes and scanning
+    for the extremes. 'graph' may be an UndirectedGraph or a prebuilt CompactGraph;
+    with vertex_weight None, the routes are scored by the graph's own vertex weights.
+    Returns (best_route, best_weight, worst_route, worst_weight), where each route is
+    a list of graph vertices (None if the graph has no route).
+
+    method "exact" uses branch and bound and adds up weights in the exhaustive
+    search's order, so it finds the same routes, ties included; "stream" scores
+    every route through bounded heaps and may pick another route of equal weight.
+
+    With workers > 1 (and a graph of at least PARALLEL_MIN_VERTICES), the start
+    vertices are split across a process pool. Each worker receives the indexed
+    graph's arrays once, searches its share of starts and returns only its local best and
+    worst routes, which are merged here.
+    """
+    vertices, search_graph = _index_graph(graph, vertex_weight, edge_weight)
+    n = len(vertices)
+
+    if workers > 1 and n >= PARALLEL_MIN_VERTICES:
+        n_chunks = min(n, workers * CHUNKS_PER_WORKER)
+        chunks = [range(i, n, n_chunks) for i in range(n_chunks)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(search_graph,)) as executor:
+            results = list(executor.map(_search_starts, chunks, repeat(method)))
+        best_path, best_weight, worst_path, worst_weight, scored = _merge_extremes(results)
+    else:
+        best_path, best_weight, worst_path, worst_weight, scored = _extremes(search_graph, range(n), method)
+    ROUTES_ENUMERATED.inc(scored, method=method)
+
+    def to_vertices(path):
+        return [vertices[i] for i in path] if path is not None else None
+
+    return to_vertices(best_path), best_weight, to_vertices(worst_path), worst_weight
+
+
+def _iter_route_totals(search_graph, crimes, starts):
+    """
+    Like _iter_routes, but yield (path, rating, crime, minutes) with the totals kept
+    apart: the search graph's vertex weights are the pubs' ratings and its costs the
+    legs' minutes, and 'crimes' holds each vertex's crime count. As in a route's
+    weight, a pub's rating and crime count are added for each leg that leaves it.
+    """
+    offsets, neighbours, costs, weights, turns = search_graph
+    path = []
+    on_path = [False] * len(weights)
+
+    def extend(current, rating, crime, minutes, via):
+        length = len(path)
+        if length >= MIN_CRAWL_PUBS and current > path[0]:
+            yield tuple(path), rating, crime, minutes
+            yield (tuple(reversed(path)), rating - weights[path[0]] + weights[current],
+                   crime - crimes[path[0]] + crimes[current], minutes)
+        if length == MAX_CRAWL_PUBS:
+            return
+
+        for slot in turns[via] if via is not None else range(offsets[current], offsets[current + 1]):
+            neighbor = neighbours[slot]
+            if on_path[neighbor]:
+                continue
+            if length == MAX_CRAWL_PUBS - 1 and neighbor < path[0]:
+                continue
+            path.append(neighbor)
+            on_path[neighbor] = True
+            yield from extend(neighbor, rating + weights[current], crime + crimes[current],
+                              minutes + costs[slot], slot)
+            on_path[neighbor] = False
+            path.pop()
+
+    for start in starts:
+        path.append(start)
+        on_path[start] = True
+        yield from extend(start, 0.0, 0.0, 0.0, None)
+        on_path[start] = False
+        path.pop()
+
+
+def _pareto(totals, rating_sense: int, crime_sense: int) -> list[tuple]:
+    """
+    The (rating, crime, minutes) keys of 'totals' that no other key dominates, where
+    higher rating is better if rating_sense is 1 (lower if -1), likewise for crime,
+    and fewer minutes are always better. Returned best rating first.
+
+    Keys are swept in order of how good their rating is, keeping a staircase of the
+    best (crime, minutes) trade-offs seen so far: a key is dominated exactly when an
+    earlier key is at least as good on both.
+    """
+    def oriented(key):
+        # Everything as a cost, lower is better.
+        rating, crime, minutes = key
+        return -rating_sense * rating, -crime_sense * crime, minutes
+
+    frontier = []
+    stair_crime, stair_minutes = [], []  # crime costs ascending, minutes strictly descending
+    for key in sorted(totals, key=oriented):
+        _, crime, minutes = oriented(key)
+        i = bisect.bisect_right(stair_crime, crime)
+        if i and stair_minutes[i - 1] <= minutes:
+            continue
+        frontier.append(key)
+        j = bisect.bisect_left(stair_crime, crime)
+        end = j
+        while end < len(stair_crime) and stair_minutes[end] >= minutes:
+            end += 1
+        stair_crime[j:end] = [crime]
+        stair_minutes[j:end] = [minutes]
+    return frontier
+
+
+def pareto_routes(graph, rating, crime) -> dict[str, list[tuple]]:
+    """
+    Enumerate every crawl once and return its Pareto frontiers over (total rating,
+    total crime, total walking minutes), one per direction in FRONTIER_SENSES, as
+    lists of (list of vertices, rating, crime, minutes), best rating first.
+
+    'rating' and 'crime' give each vertex's rating and crime count; walking minutes
+    are the graph's edge weights. For any weighting a * rating + b * crime - c * minutes
+    with c > 0, the best crawl is on the frontier whose senses match the signs of a
+    and b. Crawls with equal totals are represented by the first one enumerated.
+    """
+    compact = graph if isinstance(graph, CompactGraph) else CompactGraph.from_graph(graph)
+    vertices, search_graph = _index_graph(compact, rating, 1)
+    crimes = [crime(vertex) for vertex in vertices]
+
+    totals = {}
+    routes = 0
+    for path, route_rating, route_crime, minutes in _iter_route_totals(search_graph, crimes, range(len(vertices))):
+        routes += 1
+        totals.setdefault((route_rating, route_crime, minutes), path)
+    ROUTES_ENUMERATED.inc(routes, method="frontier")
+
+    return {
+        name: [([vertices[i] for i in totals[key]], *key) for key in _pareto(totals, rating_sense, crime_sense)]
+        for name, (rating_sense, crime_sense) in FRONTIER_SENSES.items()
+    }
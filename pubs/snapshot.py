@@ -0,0 +1,74 @@
+import logging
+import uuid
+from dataclasses import dataclass, field, replace
+from get_pubs import build_crime_index, normalized_rating
+from graph import CompactGraph
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class AreaSnapshot:
+    """
+    Everything a crawl request fetched about an area: its pubs, their crime counts
+    and the walking-time graph between them. Planner.replan plans the area again
+    from a snapshot with other options, without fetching any of it again.
+
+    Snapshots are never modified, so any number of re-plans can share one. Crimes
+    from another month give a new snapshot, with its own snapshot_id, that shares
+    the pubs and graph (see with_crimes).
+
+    pubs[i] and crime_counts[i] belong to graph.vertices[i]. The pubs hold their
+    ratings as fetched, before sentiment, normalisation and crime are applied, and
+    the graph's edge weights are walking minutes.
+    """
+    latitude: float
+    longitude: float
+    radius_km: float
+    pubs: tuple
+    graph: CompactGraph
+    crime_date: str
+    crime_radius_km: float
+    crime_counts: tuple
+    degraded: tuple = ()  # budget stages that degraded while the area was fetched
+    sentiment_scored: bool = False  # whether the pubs' reviews were fetched and their sentiment scored
+    snapshot_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # Vertex weights by sentiment weight, filled in by vertex_weights().
+    _weights: dict = field(default_factory=dict, compare=False, repr=False)
+
+    def vertex_weights(self, sentiment_weight: float = 0) -> tuple:
+        """
+        Each vertex's route weight: its pub's normalised rating less its crime count,
+        as Planner.plan scores pubs. Computed once per sentiment weight.
+        """
+        weights = self._weights.get(sentiment_weight)
+        if weights is None:
+            weights = tuple(normalized_rating(pub.rating + sentiment_weight * pub.sentiment) - count
+                            for pub, count in zip(self.pubs, self.crime_counts))
+            self._weights[sentiment_weight] = weights
+        return weights
+
+    def with_crimes(self, crimes: list, date: str, radius_km: float, degraded: bool = False) -> "AreaSnapshot":
+        """
+        A snapshot of the same area with the crimes of 'date' counted within
+        'radius_km' of each pub. Only the weights of pubs whose count changed are
+        recomputed; the rest are carried over from this snapshot. 'degraded' says
+        whether the crimes were cut short by the call budget.
+        """
+        index = build_crime_index(crimes)
+        counts = tuple(index.count_within_many([(pub.latitude, pub.longitude) for pub in self.pubs],
+                                               radius_km * 1000))
+        changed = [i for i, (old, new) in enumerate(zip(self.crime_counts, counts)) if old != new]
+        weights = {}
+        for sentiment_weight, old_weights in self._weights.items():
+            patched = list(old_weights)
+            for i in changed:
+                patched[i] -= counts[i] - self.crime_counts[i]
+            weights[sentiment_weight] = tuple(patched)
+        logger.info("Crimes of %s change the counts of %d of %d pubs", date, len(changed), len(self.pubs))
+
+        stages = [stage for stage in self.degraded if stage != "crimes"]
+        if degraded:
+            stages.append("crimes")
+        return replace(self, snapshot_id=uuid.uuid4().hex, crime_date=date, crime_radius_km=radius_km,
+                       crime_counts=counts, degraded=tuple(stages), _weights=weights)
@@ -0,0 +1,193 @@
+import math
+from geopy.distance import geodesic
+
+# WGS84 ellipsoid, the same model geopy's geodesic uses.
+WGS84_A = 6378137.0
+WGS84_E2 = 6.69437999014e-3
+
+# Planar distances within this fraction of the radius are re-checked with a full geodesic,
+# so results match geodesic() exactly while almost every point skips it.
+BOUNDARY_TOLERANCE = 0.005
+
+DEFAULT_CELL_M = 250
+# Cells are widened by this fraction of a cell when bounding their distance from a query.
+CELL_SLACK = 1e-9
+
+
+def metres_per_degree(latitude: float) -> tuple[float, float]:
+    """
+    Return the length in metres of one degree of latitude and of longitude at the given latitude.
+    """
+    phi = math.radians(latitude)
+    w = 1 - WGS84_E2 * math.sin(phi) ** 2
+    lat_m = math.pi / 180 * WGS84_A * (1 - WGS84_E2) / w ** 1.5
+    lon_m = math.pi / 180 * WGS84_A * math.cos(phi) / math.sqrt(w)
+    return lat_m, lon_m
+
+
+class GridIndex:
+    """
+    A fixed grid over a set of (latitude, longitude) points for fast radius queries.
+
+    Points are bucketed into cells roughly cell_m metres on a side, so a query only
+    looks at the few cells overlapping its circle. Distances are measured on a local
+    projection and only points right on the boundary fall back to geodesic(), so
+    the answers agree with geodesic() distance checks.
+    """
+
+    def __init__(self, points: list[tuple[float, float]], cell_m: float = DEFAULT_CELL_M):
+        self.points = points
+        self.cell_m = cell_m
+        reference_lat = sum(lat for lat, _ in points) / len(points) if points else 0.0
+        lat_m, lon_m = metres_per_degree(reference_lat)
+        self.cell_lat = cell_m / lat_m
+        self.cell_lon = cell_m / lon_m
+        self.cells = {}
+        for i, (lat, lon) in enumerate(points):
+            self.cells.setdefault(self._cell(lat, lon), []).append(i)
+        rows = [row for row, _ in self.cells] or [0]
+        cols = [col for _, col in self.cells] or [0]
+        self.bounds = (min(rows), min(cols), max(rows), max(cols))
+
+    def _cell(self, latitude: float, longitude: float) -> tuple[int, int]:
+        return math.floor(latitude / self.cell_lat), math.floor(longitude / self.cell_lon)
+
+    def _candidate_cells(self, latitude: float, longitude: float, radius_m: float):
+        # Pad the search box slightly so points just outside the planar estimate are not missed.
+        d_lat = radius_m * (1 + BOUNDARY_TOLERANCE) / metres_per_degree(latitude)[0]
+        # Degrees of longitude are shortest at the edge of the box furthest from the equator.
+        d_lon = radius_m * (1 + BOUNDARY_TOLERANCE) / metres_per_degree(min(abs(latitude) + d_lat, 89.9))[1]
+        row_min, col_min = self._cell(latitude - d_lat, longitude - d_lon)
+        row_max, col_max = self._cell(latitude + d_lat, longitude + d_lon)
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                if (row, col) in self.cells:
+                    yield row, col
+
+    def _candidates(self, latitude: float, longitude: float, radius_m: float):
+        for cell in self._candidate_cells(latitude, longitude, radius_m):
+            yield from self.cells[cell]
+
+    def _cell_distances(self, cell: tuple[int, int], latitude: float, longitude: float) -> tuple[float, float]:
+        """
+        Bounds on the squared planar distance, as within() measures it, from (latitude,
+        longitude) to any point in 'cell': (at least, at most). The longitude scale
+        count_within_many uses for the cell lies within the same bracket.
+        """
+        row, col = cell
+        # Widened by a hair so points that floating point rounding put in the cell stay inside it.
+        lat_lo, lat_hi = (row - CELL_SLACK) * self.cell_lat, (row + 1 + CELL_SLACK) * self.cell_lat
+        lon_lo, lon_hi = (col - CELL_SLACK) * self.cell_lon, (col + 1 + CELL_SLACK) * self.cell_lon
+        lat_m = metres_per_degree(latitude)[0]
+        # Longitude is scaled at the mid-latitude of the query and a point; bracket that scale.
+        mids = [(latitude + lat_lo) / 2, (latitude + lat_hi) / 2]
+        if mids[0] < 0 < mids[1]:
+            mids.append(0.0)
+        lon_scales = [metres_per_degree(mid)[1] for mid in mids]
+        near_dy = max(lat_lo - latitude, latitude - lat_hi, 0) * lat_m
+        near_dx = max(lon_lo - longitude, longitude - lon_hi, 0) * min(lon_scales)
+        far_dy = max(latitude - lat_lo, lat_hi - latitude) * lat_m
+        far_dx = max(longitude - lon_lo, lon_hi - longitude) * max(lon_scales)
+        return near_dx * near_dx + near_dy * near_dy, far_dx * far_dx + far_dy * far_dy
+
+    def within(self, latitude: float, longitude: float, radius_m: float) -> list[int]:
+        """
+        Return the indices of all points within radius_m metres of (latitude, longitude).
+        """
+        lat_m, lon_m = metres_per_degree(latitude)
+        inner = (radius_m * (1 - BOUNDARY_TOLERANCE)) ** 2
+        outer = (radius_m * (1 + BOUNDARY_TOLERANCE)) ** 2
+        found = []
+        for i in self._candidates(latitude, longitude, radius_m):
+            lat, lon = self.points[i]
+            # Evaluate the longitude scale at the mid-latitude to keep the planar error tiny.
+            mid_lon_m = metres_per_degree((lat + latitude) / 2)[1]
+            dy = (lat - latitude) * lat_m
+            dx = (lon - longitude) * mid_lon_m
+            d2 = dx * dx + dy * dy
+            if d2 <= inner:
+                found.append(i)
+            elif d2 <= outer and geodesic((latitude, longitude), (lat, lon)).m <= radius_m:
+                found.append(i)
+        return found
+
+    def nearest(self, latitude: float, longitude: float, k: int, exclude: int = None) -> list[int]:
+        """
+        Return the indices of the k points closest to (latitude, longitude), nearest first,
+        leaving out the point at index 'exclude'. Searches outward one ring of cells at a
+        time and stops once no unvisited cell can hold anything closer.
+        """
+        lat_m, lon_m = metres_per_degree(latitude)
+        # A point outside ring r is at least r cell-widths away.
+        cell_side = min(self.cell_lat * lat_m, self.cell_lon * lon_m)
+        row0, col0 = self._cell(latitude, longitude)
+        min_row, min_col, max_row, max_col = self.bounds
+        last_ring = max(row0 - min_row, max_row - row0, col0 - min_col, max_col - col0, 0)
+
+        found = []
+        for ring in range(last_ring + 1):
+            for row in range(row0 - ring, row0 + ring + 1):
+                step = 1 if row in (row0 - ring, row0 + ring) else 2 * ring
+                for col in range(col0 - ring, col0 + ring + 1, max(step, 1)):
+                    for i in self.cells.get((row, col), ()):
+                        if i == exclude:
+                            continue
+                        lat, lon = self.points[i]
+                        dy = (lat - latitude) * lat_m
+                        dx = (lon - longitude) * lon_m
+                        found.append((dx * dx + dy * dy, i))
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] <= (ring * cell_side) ** 2:
+                    break
+        found.sort()
+        return [i for _, i in found[:k]]
+
+    def count_within(self, latitude: float, longitude: float, radius_m: float) -> int:
+        """Return how many points lie within radius_m metres of (latitude, longitude)."""
+        return len(self.within(latitude, longitude, radius_m))
+
+    def count_within_many(self, queries: list[tuple[float, float]], radius_m: float) -> list[int]:
+        """
+        Answer count_within for every (latitude, longitude) in queries.
+
+        The queries are grouped by the cells their circles overlap and each cell is
+        visited once for all of them: a cell wholly inside a query's circle adds its
+        size without looking at its points, one wholly outside is skipped, and the
+        points of the rest are scanned once against every query still undecided.
+        """
+        inner = (radius_m * (1 - BOUNDARY_TOLERANCE)) ** 2
+        outer = (radius_m * (1 + BOUNDARY_TOLERANCE)) ** 2
+        lat_ms = [metres_per_degree(lat)[0] for lat, _ in queries]
+        queries_by_cell = {}
+        for q, (lat, lon) in enumerate(queries):
+            for cell in self._candidate_cells(lat, lon, radius_m):
+                queries_by_cell.setdefault(cell, []).append(q)
+
+        counts = [0] * len(queries)
+        for cell, cell_queries in queries_by_cell.items():
+            members = self.cells[cell]
+            undecided = []
+            for q in cell_queries:
+                near, far = self._cell_distances(cell, *queries[q])
+                if far <= inner:
+                    counts[q] += len(members)
+                elif near <= outer:
+                    undecided.append(q)
+            if not undecided:
+                continue
+            # Longitude is scaled at the mid-latitude of the query and the cell's centre rather
+            # than each point: across a cell the difference is far inside BOUNDARY_TOLERANCE, and
+            # any point near enough to the boundary for it to matter is settled by geodesic().
+            centre_lat = (cell[0] + 0.5) * self.cell_lat
+            scales = [(q, queries[q][0], queries[q][1], lat_ms[q],
+                       metres_per_degree((queries[q][0] + centre_lat) / 2)[1]) for q in undecided]
+            for i in members:
+                lat, lon = self.points[i]
+                for q, q_lat, q_lon, lat_m, lon_m in scales:
+                    dy = (lat - q_lat) * lat_m
+                    dx = (lon - q_lon) * lon_m
+                    d2 = dx * dx + dy * dy
+                    if d2 <= inner or (d2 <= outer and geodesic((q_lat, q_lon), (lat, lon)).m <= radius_m):
+                        counts[q] += 1
+        return counts
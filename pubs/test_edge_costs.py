@@ -0,0 +1,58 @@
+from collections import Counter
+import pytest
+import ratelimit
+from directions import directions_cache, get_route_with_polyline
+from edge_costs import DirectionsCostProvider, DistanceMatrixCostProvider, EdgeCostProvider
+from get_pubs import pub_from_place
+from test_planner import AREA_CENTRE, FakeGmaps
+
+
+class CountingGmaps(FakeGmaps):
+    def __init__(self):
+        super().__init__(n_pubs=8)
+        self.calls = Counter()
+
+    def directions(self, origin, destination, mode):
+        self.calls["directions"] += 1
+        return super().directions(origin, destination, mode)
+
+    def distance_matrix(self, origins, destinations, mode):
+        self.calls["distance_matrix"] += 1
+        return super().distance_matrix(origins, destinations, mode)
+
+
+@pytest.fixture
+def gmaps(monkeypatch):
+    monkeypatch.setattr(ratelimit, "ENABLED", False)
+    directions_cache.clear()
+    return CountingGmaps()
+
+
+def pairs_of(gmaps: FakeGmaps) -> list[tuple]:
+    pubs = [pub_from_place(place, *AREA_CENTRE) for place in gmaps.places]
+    return [(start, end) for i, start in enumerate(pubs) for end in pubs[i + 1:]]
+
+
+def test_edge_cost_provider_is_abstract():
+    with pytest.raises(TypeError):
+        EdgeCostProvider()
+
+
+def test_matrix_legs_are_not_bought_again(gmaps):
+    pairs = pairs_of(gmaps)
+    routes = DistanceMatrixCostProvider(gmaps).get_routes(pairs)
+    assert len(routes) == len(pairs)
+    assert gmaps.calls["directions"] == 0
+
+    # Either way round, the Directions provider finds every leg in the shared cache.
+    assert DirectionsCostProvider(gmaps).get_routes([(end, start) for start, end in pairs]) == [
+        (end, start, distance, minutes) for start, end, distance, minutes in routes]
+    assert gmaps.calls["directions"] == 0
+
+    # Only the polyline of a leg on the crawl is fetched, once.
+    start, end = pairs[0]
+    for _ in range(2):
+        distance, _, points = get_route_with_polyline(end, start, gmaps)
+        assert distance == routes[0][2]
+        assert points[0] == pytest.approx((end.latitude, end.longitude), abs=1e-5)
+    assert gmaps.calls == {"distance_matrix": 1, "directions": 1}
@@ -0,0 +1,62 @@
+import random
+import pytest
+import search
+from graph import CompactGraph, UndirectedGraph
+from location import Location
+
+CENTRE = (51.4315, -0.5480)
+
+
+def random_graph(n: int, seed: int) -> UndirectedGraph:
+    rng = random.Random(seed)
+    graph = UndirectedGraph()
+    pubs = [Location(CENTRE[0] + rng.uniform(-0.01, 0.01), CENTRE[1] + rng.uniform(-0.015, 0.015),
+                     f"Pub {i}", {"rating": 0})
+            for i in range(n)]
+    for pub in pubs:
+        graph.add_vertex(pub, weight=rng.randint(-5, 25))
+    for i, pub in enumerate(pubs):
+        for other in pubs[i + 1:]:
+            if rng.random() < 0.4:
+                graph.add_edge(pub, other, rng.randint(2, 20))
+    return graph
+
+
+def test_compact_graph_is_frozen():
+    compact = CompactGraph.from_graph(random_graph(8, seed=1))
+
+    for name in ("vertices", "vertex_weights", "offsets", "neighbours", "edge_weights"):
+        with pytest.raises(AttributeError):
+            setattr(compact, name, ())
+    with pytest.raises(TypeError):
+        compact.index[compact.vertices[0]] = 1
+    with pytest.raises(AttributeError):
+        compact.anything = 1
+
+
+def test_edge_lookups_match_the_graph():
+    graph = random_graph(12, seed=2)
+    compact = CompactGraph.from_graph(graph)
+
+    for i, vertex in enumerate(compact.vertices):
+        neighbours = dict(graph.get_neighbors(vertex))
+        assert compact.vertex_weights[i] == graph.get_vertex_weight(vertex)
+        for j, other in enumerate(compact.vertices):
+            assert compact.edge_weight(i, j) == neighbours.get(other)
+            slot = compact.edge_slot(i, j)
+            assert (slot is None) == (other not in neighbours)
+            if slot is not None:
+                assert compact.neighbours[slot] == j
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_search_by_the_graphs_vertex_weights(seed):
+    graph = random_graph(10, seed)
+    compact = CompactGraph.from_graph(graph)
+    rng = random.Random(seed)
+    weights = [rng.randint(-10, 30) for _ in compact.vertices]
+    weighted = compact.with_vertex_weights(weights)
+
+    assert weighted.neighbours is compact.neighbours
+    by_callable = search.best_and_worst_routes(compact, lambda v: weights[compact.index[v]], 0.3)
+    assert search.best_and_worst_routes(weighted, None, 0.3) == by_callable
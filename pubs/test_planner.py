@@ -0,0 +1,165 @@
+import random
+import sys
+import threading
+import types
+import polyline
+import pytest
+import crime
+import ratelimit
+from planner import Planner, PlannerConfig
+
+AREA_CENTRE = (51.4315, -0.548)
+
+
+class FakeGmaps:
+    """
+    A googlemaps.Client stand-in for a made-up area: seeded pubs, and walking legs
+    whose length follows the distance between their ends.
+    """
+
+    def __init__(self, n_pubs: int = 30, seed: int = 3):
+        rng = random.Random(seed)
+        lat, lng = AREA_CENTRE
+        self.places = [
+            {"name": f"Pub {i}", "place_id": f"pub-{i}", "vicinity": f"{i} High Street",
+             "rating": round(rng.uniform(2.5, 5), 1), "user_ratings_total": rng.randint(5, 900),
+             "geometry": {"location": {"lat": lat + rng.uniform(-0.012, 0.012),
+                                       "lng": lng + rng.uniform(-0.018, 0.018)}}}
+            for i in range(n_pubs)
+        ]
+        self._places = {place["place_id"]: place for place in self.places}
+
+    def places_nearby(self, **params):
+        return {"results": self.places}
+
+    def place(self, place_id, fields):
+        place = self._places[place_id]
+        # Reviewers love the low-rated pubs and are lukewarm about the rest.
+        review = "Hidden gem" if place["rating"] < 3.5 else "Overrated"
+        return {"result": {"rating": place["rating"], "user_ratings_total": place["user_ratings_total"],
+                           "photos": [{"photo_reference": f"photo-{place_id}"}],
+                           "reviews": [{"text": review}]}}
+
+    @staticmethod
+    def _leg(origin, destination):
+        metres = int(abs(origin[0] - destination[0]) * 1e5 + abs(origin[1] - destination[1]) * 1e5)
+        seconds = int(metres * 0.8)
+        return {"distance": {"value": metres, "text": f"{metres} m"},
+                "duration": {"value": seconds, "text": f"{max(1, seconds // 60)} mins"}}
+
+    def directions(self, origin, destination, mode):
+        return [{"legs": [self._leg(origin, destination)],
+                 "overview_polyline": {"points": polyline.encode([origin, destination])}}]
+
+    def distance_matrix(self, origins, destinations, mode):
+        return {"rows": [{"elements": [{"status": "OK", **self._leg(origin, destination)}
+                                       for destination in destinations]}
+                         for origin in origins]}
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self._body = body
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        pass
+
+
+class FakePoliceSession:
+    """A crime.session stand-in answering custom area queries from seeded crimes."""
+
+    def __init__(self, n_crimes: int = 2000, seed: int = 4):
+        rng = random.Random(seed)
+        lat, lng = AREA_CENTRE
+        self.crimes = [
+            {"id": i, "category": "anti-social-behaviour",
+             "location": {"latitude": str(lat + rng.uniform(-0.02, 0.02)),
+                          "longitude": str(lng + rng.uniform(-0.03, 0.03))}}
+            for i in range(n_crimes)
+        ]
+
+    def post(self, url, data=None):
+        corners = [tuple(map(float, corner.split(","))) for corner in data["poly"].split(":")]
+        south, north = min(c[0] for c in corners), max(c[0] for c in corners)
+        west, east = min(c[1] for c in corners), max(c[1] for c in corners)
+        return FakeResponse([c for c in self.crimes
+                             if south <= float(c["location"]["latitude"]) <= north
+                             and west <= float(c["location"]["longitude"]) <= east])
+
+
+class FakeSentimentEngine:
+    """An nlp.SentimentEngine stand-in with fixed scores, as nltk's Vader lexicon may not be installed."""
+
+    SCORES = {"Hidden gem": 1.0, "Overrated": -0.5}
+
+    def score_pubs(self, pubs, workers=1):
+        for pub in pubs:
+            scores = [self.SCORES[review["text"]] for review in pub.reviews or []]
+            pub.sentiment = sum(scores) / len(scores) if scores else 0.0
+        return pubs
+
+
+@pytest.fixture
+def area(monkeypatch):
+    monkeypatch.setattr(crime, "session", FakePoliceSession())
+    monkeypatch.setattr(ratelimit, "ENABLED", False)
+    return FakeGmaps()
+
+
+# Every combination of the request options, so no two settings can be mistaken for each other.
+CONFIGS = [
+    PlannerConfig.from_attr({"maximise_rating": rating, "range": 2, "walking": walking, "warrior_mode": warrior})
+    for warrior in (False, True) for rating in (0, 1) for walking in (0, 1, 2)
+]
+
+
+def plan(config: PlannerConfig, gmaps: FakeGmaps) -> list:
+    routes = Planner(config, gmaps=gmaps).plan(*AREA_CENTRE)
+    return [(route.start_node.name, route.start_node.rating, route.end_node.name, route.end_node.rating)
+            for route in routes]
+
+
+def test_interleaved_plans_keep_their_own_settings(area):
+    serial = [plan(config, area) for config in CONFIGS]
+    assert len(set(map(tuple, serial))) > 1, "the settings should lead to different crawls"
+
+    results = {}
+    barrier = threading.Barrier(len(CONFIGS))
+
+    def worker(i):
+        barrier.wait()
+        for repeat in range(3):
+            results[i, repeat] = plan(CONFIGS[i], area)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(CONFIGS))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for i, config in enumerate(CONFIGS):
+        for repeat in range(3):
+            assert results[i, repeat] == serial[i], config
+
+
+def test_sentiment_weight_reorders_the_crawls(area, monkeypatch):
+    nlp = types.ModuleType("nlp")
+    nlp.get_engine = FakeSentimentEngine
+    monkeypatch.setitem(sys.modules, "nlp", nlp)
+    attr = {"maximise_rating": 1, "range": 2, "walking": 2, "warrior_mode": False}
+
+    assert PlannerConfig.from_attr(attr).sentiment_weight == 0
+    unweighted = plan(PlannerConfig.from_attr(attr), area)
+    weighted = plan(PlannerConfig.from_attr({**attr, "sentiment_weight": 2}), area)
+
+    assert weighted != unweighted
+    # Two stars per unit of sentiment put the pubs the reviewers love first: every leg now
+    # leaves from one (a pub counts towards a crawl when a leg leaves it).
+    stars = {place["name"]: place["rating"] for place in area.places}
+    assert all(stars[start] < 3.5 for start, _, _, _ in weighted)
+    assert not all(stars[start] < 3.5 for start, _, _, _ in unweighted)
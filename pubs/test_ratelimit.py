@@ -0,0 +1,63 @@
+import googlemaps
+import pytest
+import ratelimit
+from metrics import UPSTREAM_CALLS
+from ratelimit import call_with_backoff, new_client
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class ThrottlingSession:
+    """A requests.Session stand-in answering OVER_QUERY_LIMIT 'throttled' times, then OK."""
+
+    def __init__(self, throttled: int):
+        self.throttled = throttled
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        if self.calls <= self.throttled:
+            return FakeResponse({"status": "OVER_QUERY_LIMIT", "error_message": "slow down"})
+        return FakeResponse({"status": "OK", "result": {"rating": 4.5}})
+
+
+@pytest.fixture(autouse=True)
+def no_waiting(monkeypatch):
+    monkeypatch.setattr(ratelimit, "ENABLED", False)
+    monkeypatch.setattr(ratelimit, "BACKOFF_BASE_S", 0)
+
+
+def throttled_client(session: ThrottlingSession) -> googlemaps.Client:
+    client = new_client("AIza-test-key")
+    client.session = session
+    return client
+
+
+def test_over_query_limit_is_retried_by_call_with_backoff():
+    session = ThrottlingSession(throttled=2)
+    retries = UPSTREAM_CALLS.value(upstream="places_details", outcome="retry")
+
+    result = call_with_backoff("places_details", throttled_client(session).place, place_id="pub-1",
+                               fields=["rating"])
+
+    assert result["result"] == {"rating": 4.5}
+    assert session.calls == 3
+    assert UPSTREAM_CALLS.value(upstream="places_details", outcome="retry") == retries + 2
+
+
+def test_over_query_limit_gives_up_after_max_retries():
+    session = ThrottlingSession(throttled=ratelimit.MAX_RETRIES + 1)
+
+    with pytest.raises(googlemaps.exceptions.ApiError) as raised:
+        call_with_backoff("places_details", throttled_client(session).place, place_id="pub-1", fields=["rating"])
+
+    assert raised.value.status == "OVER_QUERY_LIMIT"
+    assert session.calls == ratelimit.MAX_RETRIES + 1
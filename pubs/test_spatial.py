@@ -0,0 +1,72 @@
+import random
+import pytest
+from geopy.distance import geodesic
+from get_pubs import PubData, adjust_pub_ratings_for_crime, normalized_rating
+from spatial import GridIndex
+
+CENTRE = (51.4315, -0.5480)
+RADII_M = [50, 100, 300, 1000]
+
+
+def random_points(n: int, spread: tuple[float, float], seed: int) -> list[tuple[float, float]]:
+    rng = random.Random(seed)
+    return [(CENTRE[0] + rng.uniform(-spread[0], spread[0]), CENTRE[1] + rng.uniform(-spread[1], spread[1]))
+            for _ in range(n)]
+
+
+def boundary_points(centre: tuple[float, float], radius_m: float) -> list[tuple[float, float]]:
+    """Points on, just inside and just outside the circle, at bearings all the way round."""
+    points = []
+    for bearing in range(0, 360, 15):
+        for offset_m in (0, -1e-6, 1e-6, -0.5, 0.5):
+            destination = geodesic(meters=radius_m + offset_m).destination(centre, bearing)
+            points.append((destination.latitude, destination.longitude))
+    return points
+
+
+def geodesic_counts(queries, points, radius_m: float) -> list[int]:
+    return [sum(1 for point in points if geodesic(query, point).m <= radius_m) for query in queries]
+
+
+@pytest.mark.parametrize("radius_m", RADII_M)
+def test_count_within_many_matches_geodesic(radius_m):
+    points = random_points(800, (0.03, 0.05), seed=42)
+    queries = random_points(20, (0.02, 0.03), seed=43)
+    index = GridIndex(points)
+    assert index.count_within_many(queries, radius_m) == geodesic_counts(queries, points, radius_m)
+
+
+@pytest.mark.parametrize("radius_m", RADII_M)
+def test_count_within_many_on_the_boundary(radius_m):
+    points = boundary_points(CENTRE, radius_m)
+    index = GridIndex(points)
+    assert index.count_within_many([CENTRE], radius_m) == geodesic_counts([CENTRE], points, radius_m)
+
+
+@pytest.mark.parametrize("radius_m", RADII_M + [2500])
+def test_count_within_many_matches_count_within(radius_m):
+    # Dense enough that whole cells fall inside and outside the circles.
+    points = random_points(20000, (0.03, 0.05), seed=46)
+    queries = random_points(40, (0.03, 0.05), seed=47) + [points[0], points[-1]]
+    index = GridIndex(points)
+    assert index.count_within_many(queries, radius_m) == [index.count_within(lat, lng, radius_m)
+                                                          for lat, lng in queries]
+
+
+@pytest.mark.parametrize("radius_m", RADII_M)
+def test_adjust_pub_ratings_for_crime_matches_geodesic(radius_m):
+    locations = random_points(15, (0.02, 0.03), seed=44)
+    crime_points = random_points(600, (0.03, 0.05), seed=45) + boundary_points(locations[0], radius_m)
+    crimes = [{"id": i, "location": {"latitude": str(lat), "longitude": str(lng)}}
+              for i, (lat, lng) in enumerate(crime_points)]
+    crimes.append({"id": len(crimes), "location": {"latitude": "", "longitude": "n/a"}})  # skipped
+    pubs = [PubData(f"Pub {i}", lat, lng, rating=4.2) for i, (lat, lng) in enumerate(locations)]
+
+    adjust_pub_ratings_for_crime(pubs, crimes, threshold_km=radius_m / 1000)
+
+    # The string round trip is what the police API's locations go through.
+    points = [(float(c["location"]["latitude"]), float(c["location"]["longitude"])) for c in crimes[:-1]]
+    expected = geodesic_counts(locations, points, radius_m)
+    assert [pub.crime_count for pub in pubs] == expected
+    assert [pub.nearby_crimes for pub in pubs] == expected
+    assert [pub.rating for pub in pubs] == [normalized_rating(4.2) - count for count in expected]
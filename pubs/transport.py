@@ -0,0 +1,236 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+import googlemaps
+import requests
+
+# Where recorded responses live, one JSON file per distinct request.
+FIXTURES_PATH = os.environ.get(
+    "PINTCRAWLER_FIXTURES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+)
+
+# HTTP status of injected police API failures. Not 503, which makes get_crimes_in_box
+# split the area into requests that were never recorded.
+INJECTED_HTTP_STATUS = 500
+
+logger = logging.getLogger(__name__)
+
+
+class FixtureMissing(KeyError):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+class FixtureStore:
+    """
+    Recorded API responses on disk, keyed by service, method and the request's
+    parameters. Each response is a JSON file under <path>/<service>/, named by a
+    hash of the request, so recordings can be inspected, diffed and committed.
+    """
+
+    def __init__(self, path: str = FIXTURES_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def request_key(method: str, params: dict) -> str:
+        canonical = json.dumps({"method": method, "params": params}, sort_keys=True, default=str)
+        return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+    def _file(self, service: str, method: str, params: dict) -> str:
+        return os.path.join(self.path, service, f"{method}-{self.request_key(method, params)}.json")
+
+    def get(self, service: str, method: str, params: dict):
+        """Return the recorded response, or raise FixtureMissing."""
+        try:
+            with open(self._file(service, method, params)) as f:
+                return json.load(f)["response"]
+        except FileNotFoundError:
+            raise FixtureMissing(f"no recorded {service}.{method} response for {params}")
+
+    def put(self, service: str, method: str, params: dict, response):
+        """Record a response, replacing any earlier recording of the same request."""
+        file = self._file(service, method, params)
+        with self._lock:
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            with open(file + ".tmp", "w") as f:
+                json.dump({"service": service, "method": method, "params": params, "response": response},
+                          f, indent=1, sort_keys=True, default=str)
+            os.replace(file + ".tmp", file)
+
+
+class Faults:
+    """
+    Latency and error injection shared by the transports: every call waits latency_s
+    (plus up to jitter_s more) and fails with probability error_rate. The random
+    choices come from a seeded generator, so a serial run is reproducible.
+    Google failures are retried by the rate limiter, but a failed police request
+    loses that area's crimes, which can change the plan (and, in replay, lead to
+    requests that were never recorded).
+    """
+
+    def __init__(self, latency_s: float = 0.0, jitter_s: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def apply(self) -> bool:
+        """Sleep for the injected latency and return whether this call should fail."""
+        with self._lock:
+            delay = self.latency_s + self._random.uniform(0, self.jitter_s)
+            fail = self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return fail
+
+
+class GoogleMapsTransport:
+    """
+    Stands in for a googlemaps.Client: in "record" mode every call goes to the real
+    client and its response is saved to the store; in "replay" mode responses come
+    from the store and the network is never used. Injected failures surface as
+    ApiError("OVER_QUERY_LIMIT"), the error the rate limiter retries.
+    """
+
+    def __init__(self, store: FixtureStore, mode: str, client: googlemaps.Client = None, faults: Faults = None):
+        if mode == "record" and client is None:
+            raise ValueError("record mode needs a real googlemaps.Client")
+        self.store = store
+        self.mode = mode
+        self.client = client
+        self.faults = faults or Faults()
+
+    def _call(self, method: str, **params):
+        if self.faults.apply():
+            raise googlemaps.exceptions.ApiError("OVER_QUERY_LIMIT", "injected failure")
+        if self.mode == "replay":
+            return self.store.get("gmaps", method, params)
+        response = getattr(self.client, method)(**params)
+        self.store.put("gmaps", method, params, response)
+        return response
+
+    def places_nearby(self, **params):
+        return self._call("places_nearby", **params)
+
+    def place(self, **params):
+        return self._call("place", **params)
+
+    def directions(self, **params):
+        return self._call("directions", **params)
+
+    def distance_matrix(self, **params):
+        return self._call("distance_matrix", **params)
+
+
+class ReplayResponse:
+    """The parts of requests.Response the police API callers use."""
+
+    def __init__(self, status_code: int, body, url: str = ""):
+        self.status_code = status_code
+        self._body = body
+        self.url = url
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class PoliceTransport:
+    """
+    Stands in for crime.session (a requests.Session) with the same record/replay
+    modes as GoogleMapsTransport. The status code is recorded with the body, so
+    503 responses (areas with too many crimes) replay as 503s.
+    """
+
+    def __init__(self, store: FixtureStore, mode: str, session: requests.Session = None, faults: Faults = None):
+        self.store = store
+        self.mode = mode
+        self.session = session or requests.Session()
+        self.faults = faults or Faults()
+
+    def _request(self, method: str, url: str, **params):
+        if self.faults.apply():
+            return ReplayResponse(INJECTED_HTTP_STATUS, None, url)
+        key = {"url": url, **params}
+        if self.mode == "replay":
+            recorded = self.store.get("police", method, key)
+            return ReplayResponse(recorded["status_code"], recorded["body"], url)
+        response = getattr(self.session, method)(url, **params)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        self.store.put("police", method, key, {"status_code": response.status_code, "body": body})
+        return ReplayResponse(response.status_code, body, url)
+
+    def get(self, url: str, params: dict = None):
+        return self._request("get", url, params=params)
+
+    def post(self, url: str, data: dict = None):
+        return self._request("post", url, data=data)
+
+
+def install(mode: str, path: str = FIXTURES_PATH, faults: Faults = None):
+    """
+    Route the planner's default Google Maps client and the police API session through
+    record/replay transports, with the API caches moved to empty in-memory stores.
+    Replay also turns off client-side rate limiting and the next-page wait, so the
+    planner runs at full speed offline.
+    """
+    # Imported here: the planner pulls in most of the app, and transport should not.
+    import crime
+    import directions
+    import get_pubs
+    import places
+    import planner
+    import ratelimit
+
+    store = FixtureStore(path)
+    faults = faults or Faults()
+    if mode == "replay":
+        planner.set_default_client(GoogleMapsTransport(store, mode, faults=faults))
+        crime.session = PoliceTransport(store, mode, faults=faults)
+        ratelimit.ENABLED = False
+        places.NEXT_PAGE_DELAY_S = 0.0
+    elif mode == "record":
+        planner.set_default_client(GoogleMapsTransport(store, mode, planner.default_client(), faults))
+        crime.session = PoliceTransport(store, mode, crime.session, faults)
+    else:
+        raise ValueError(f"unknown transport mode {mode!r}")
+    # A call answered from a warm persistent cache is never recorded, and its replay
+    # elsewhere would miss it; both modes start from empty in-memory caches instead.
+    for persistent in (places.places_search_cache, get_pubs.places_details_cache, directions.directions_cache):
+        persistent.reopen(":memory:")
+        persistent.clear()
+    logger.info("Transport: %s using fixtures in %s", mode, path)
+
+
+def install_from_env():
+    """
+    Configure the transport from the environment, if PINTCRAWLER_TRANSPORT is set:
+        PINTCRAWLER_TRANSPORT   "record" or "replay"
+        PINTCRAWLER_FIXTURES    fixture directory (default pubs/fixtures)
+        PINTCRAWLER_LATENCY_MS  latency added to every call
+        PINTCRAWLER_JITTER_MS   extra random latency, up to this much
+        PINTCRAWLER_ERROR_RATE  fraction of calls that fail (0..1)
+        PINTCRAWLER_FAULT_SEED  seed for the injected latency and errors
+    """
+    mode = os.environ.get("PINTCRAWLER_TRANSPORT")
+    if not mode:
+        return
+    faults = Faults(
+        latency_s=float(os.environ.get("PINTCRAWLER_LATENCY_MS", 0)) / 1000,
+        jitter_s=float(os.environ.get("PINTCRAWLER_JITTER_MS", 0)) / 1000,
+        error_rate=float(os.environ.get("PINTCRAWLER_ERROR_RATE", 0)),
+        seed=int(os.environ.get("PINTCRAWLER_FAULT_SEED", 0))
+    )
+    install(mode, FIXTURES_PATH, faults)